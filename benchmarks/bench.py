@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+DESCRIPTION = '''
+Throughput and latency benchmark for the invoker.
+
+Starts the invoker in a child process serving one of the functions in benchmarks/functions, drives it with
+concurrent keep-alive HTTP connections for a fixed time and reports requests per second and latency percentiles.
+Results can be saved as JSON and compared with an earlier run:
+
+    python benchmarks/bench.py --model request --concurrency 16 --output before.json
+    python benchmarks/bench.py --model request --concurrency 16 --baseline before.json
+'''
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(BASE_DIR, 'benchmarks', 'functions')
+
+MODELS = {
+    'request': ('bench_request.py', 'echo', 'POST'),
+    'stream': ('bench_stream.py', 'echo', 'POST'),
+    'source': ('bench_source.py', 'counter', 'GET'),
+}
+
+# latency percentiles compared against a baseline, with throughput
+METRICS = ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def payload(size, contenttype):
+    if contenttype.startswith('application/json'):
+        return json.dumps({'data': 'x' * max(size - 12, 0)}).encode()
+    if contenttype.startswith('text/'):
+        return b'x' * size
+    return os.urandom(size)
+
+
+def start_invoker(model, port, env):
+    module, handler, _ = MODELS[model]
+    env = dict(os.environ, **env)
+    env.update({
+        'FUNCTION_URI': 'file://%s/%s?handler=%s' % (FUNCTIONS_DIR, module, handler),
+        'PORT': str(port),
+        'PYTHONPATH': os.pathsep.join([BASE_DIR, FUNCTIONS_DIR]),
+    })
+    process = subprocess.Popen([sys.executable, '-m', 'invoker.function_invoker'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("invoker exited with status %d" % process.returncode)
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("invoker did not start listening on port %d" % port)
+
+
+def drive(port, method, body, headers, duration, latencies, errors):
+    """send requests over one keep-alive connection until the duration has passed"""
+    connection = http.client.HTTPConnection('localhost', port)
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request(method, '/', body=body if method == 'POST' else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as err:
+            errors.append(repr(err))
+            connection.close()
+            connection = http.client.HTTPConnection('localhost', port)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def run_load(port, method, body, headers, concurrency, duration):
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=drive, args=(port, method, body, headers, duration, latencies, errors))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': _ms(percentile(latencies, 0.50)),
+        'p95_ms': _ms(percentile(latencies, 0.95)),
+        'p99_ms': _ms(percentile(latencies, 0.99)),
+        'max_ms': _ms(latencies[-1] if latencies else None),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    :return: a list of descriptions of the metrics that regressed by more than tolerance percent
+    """
+    regressions = []
+    for metric in METRICS:
+        old, new = baseline['results'].get(metric), result['results'].get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) * 100.0 / old
+        # throughput should not fall, latency should not rise
+        worse = -change if metric == 'rps' else change
+        print("%-8s %10s -> %10s  %+6.1f%%" % (metric, old, new, change))
+        if worse > tolerance:
+            regressions.append("%s %+.1f%%" % (metric, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=sorted(MODELS), default='request', help='interaction model to drive')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent connections')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to measure for')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds to drive before measuring')
+    parser.add_argument('--payload-size', type=int, default=128, help='request body size in bytes')
+    parser.add_argument('--content-type', default='text/plain', help='request Content-Type')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='environment variable for the invoker, such as WORKERS=4 (repeatable)')
+    parser.add_argument('--port', type=int, default=0, help='port for the invoker, a free port by default')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with those in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help='percentage a metric may regress against the baseline before the run fails')
+    args = parser.parse_args(argv)
+
+    env = dict(entry.split('=', 1) for entry in args.env)
+    port = args.port or _free_port()
+    method = MODELS[args.model][2]
+    body = payload(args.payload_size, args.content_type)
+    headers = {'Content-Type': args.content_type}
+
+    process = start_invoker(args.model, port, env)
+    try:
+        if args.warmup:
+            run_load(port, method, body, headers, args.concurrency, args.warmup)
+        latencies, errors, elapsed = run_load(port, method, body, headers, args.concurrency, args.duration)
+    finally:
+        process.terminate()
+        process.wait()
+
+    result = {
+        'config': {
+            'model': args.model,
+            'concurrency': args.concurrency,
+            'duration_s': args.duration,
+            'payload_size': args.payload_size,
+            'content_type': args.content_type,
+            'env': env,
+        },
+        'system': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': summarize(latencies, errors, elapsed),
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(result, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(result, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("regressed: " + ", ".join(regressions))
+            return 1
+    return 0
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('', 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2 @@
+def echo(payload):
+    return payload
@@ -0,0 +1,5 @@
+from itertools import count
+
+
+def counter():
+    return (str(i) for i in count())
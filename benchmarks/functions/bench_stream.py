@@ -0,0 +1,5 @@
+interaction_model = "stream"
+
+
+def echo(stream):
+    return (payload for payload in stream)
@@ -0,0 +1,84 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import math
+
+
+class AdmissionController(object):
+    """Decides whether a request may start an invocation, so that an overloaded invoker rejects requests
+    straight away instead of holding their connections while they wait
+    """
+
+    def __init__(self, limit=0, queue_wait=0.1, retry_after=1, adaptive=False, max_limit=1000):
+        """
+        :param limit: the maximum number of invocations in flight, 0 for no limit. With adaptive set, the limit to
+        start from.
+        :param queue_wait: the longest time in seconds a request may wait for room in the input queue
+        :param retry_after: the Retry-After, in seconds, sent with a rejection
+        :param adaptive: adjust the limit from observed latency
+        :param max_limit: the highest limit the adaptive mode may reach
+        """
+        self.adaptive = adaptive
+        self.limit = float(limit or (20 if adaptive else 0))
+        self.queue_wait = queue_wait
+        self.retry_after = retry_after
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.min_latency = None
+        self.samples = 0
+
+    @classmethod
+    def from_env(cls, env):
+        """
+        :param env: a dict containing the runtime environment, usually os.environ
+        :return: an AdmissionController configured by MAX_CONCURRENCY, QUEUE_WAIT_MS, RETRY_AFTER and
+        ADAPTIVE_CONCURRENCY
+        """
+        return cls(limit=int(env.get('MAX_CONCURRENCY', 0)),
+                   queue_wait=int(env.get('QUEUE_WAIT_MS', 100)) / 1000.0,
+                   retry_after=int(env.get('RETRY_AFTER', 1)),
+                   adaptive=env.get('ADAPTIVE_CONCURRENCY', '').lower() in ('1', 'true', 'yes'))
+
+    def acquire(self):
+        """
+        :return: True if an invocation may start, it must be followed by release()
+        """
+        if self.limit and self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency):
+        """
+        :param latency: the time in seconds the invocation took
+        :return: None
+        """
+        self.in_flight -= 1
+        if self.adaptive:
+            self._adapt(latency)
+
+    def _adapt(self, latency):
+        # The gradient of the lowest latency seen over the current latency shrinks the limit as queueing builds up,
+        # and the square root headroom lets it grow while latency stays close to the lowest.
+        self.samples += 1
+        if self.min_latency is None or latency < self.min_latency or self.samples % 1000 == 0:
+            # forget the lowest latency now and then, the function's own cost may have changed
+            self.min_latency = latency
+        if latency <= 0:
+            return
+        gradient = max(0.5, min(1.0, self.min_latency / latency))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = max(1.0, min(float(self.max_limit), 0.8 * self.limit + 0.2 * target))
@@ -0,0 +1,125 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Bridges gevent and an asyncio event loop running in its own native thread.
+# Greenlets wait on coroutines without blocking the gevent hub, and coroutines
+# wait on greenlets without blocking the event loop.
+
+import asyncio
+import os
+import threading
+
+import gevent
+from gevent.event import Event
+
+_END = object()
+_lock = threading.Lock()
+_loop = None
+_pid = None
+
+
+def event_loop():
+    """
+    :return: the asyncio event loop shared by all async functions, started on first use in this process
+    """
+    global _loop, _pid
+    with _lock:
+        # threads do not survive a fork, a worker process needs its own loop
+        if _loop is None or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name='asyncio', daemon=True).start()
+    return _loop
+
+
+def run(awaitable):
+    """
+    Run an awaitable on the event loop, blocking only the current greenlet until it completes
+    :param awaitable: a coroutine or other awaitable
+    :return: the awaitable's result
+    """
+    return wait(asyncio.run_coroutine_threadsafe(_await(awaitable), event_loop()))
+
+
+def wait(future):
+    """
+    Block the current greenlet, not the hub, until a concurrent.futures.Future completes
+    :param future: a concurrent.futures.Future completed by another thread
+    :return: the future's result
+    """
+    if not future.done():
+        watcher = gevent.get_hub().loop.async_()
+        done = Event()
+        watcher.start(done.set)
+        future.add_done_callback(lambda _: watcher.send())
+        try:
+            done.wait()
+        finally:
+            watcher.close()
+    return future.result()
+
+
+def iterate(agen):
+    """
+    :param agen: an async iterator
+    :return: a generator yielding the items of agen, each awaited on the event loop
+    """
+    while True:
+        try:
+            yield run(agen.__anext__())
+        except StopAsyncIteration:
+            return
+
+
+def aiter(iterator):
+    """
+    :param iterator: an iterator that may block on gevent, such as a gevent Queue
+    :return: an async iterator yielding the items of iterator, each fetched by a greenlet on the calling thread's hub
+    """
+    hub = gevent.get_hub()
+
+    async def items():
+        loop = asyncio.get_event_loop()
+        while True:
+            future = loop.create_future()
+            hub.loop.run_callback_threadsafe(gevent.spawn, _fetch, iterator, loop, future)
+            item = await future
+            if item is _END:
+                return
+            yield item
+
+    return items()
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def _fetch(iterator, loop, future):
+    try:
+        loop.call_soon_threadsafe(_set_result, future, next(iterator, _END))
+    except BaseException as err:
+        loop.call_soon_threadsafe(_set_exception, future, err)
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, err):
+    if not future.done():
+        future.set_exception(err)
@@ -0,0 +1,124 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Caches encoded responses of functions that opt in with a module level cache attribute. The cache is used by
+# greenlets on the hub's thread only, so like the metrics it needs no locking.
+
+import hashlib
+import time
+from collections import OrderedDict
+
+from gevent.event import AsyncResult
+
+
+class ResponseCache(object):
+    """A least recently used cache of responses with an optional time to live. Concurrent requests for a key that
+    is not cached yet share a single computation.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        """
+        :param max_entries: the number of responses kept, the least recently used is evicted first
+        :param ttl: the time in seconds a response is kept, None to keep it until it is evicted
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.in_flight = {}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: a function module's cache attribute, a dict with optional max_entries and ttl keys, or True
+        for the defaults
+        :return: a ResponseCache, or None if config is empty
+        """
+        if not config:
+            return None
+        if config is True:
+            return cls()
+        return cls(**config)
+
+    def get(self, key):
+        """
+        :param key: a key made by key()
+        :return: the cached response, or None if it is not cached or has expired
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        :param key: a key made by key()
+        :param value: the response
+        :return: None
+        """
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute, cacheable=lambda value: True):
+        """
+        :param key: a key made by key()
+        :param compute: a callable computing the response on a miss
+        :param cacheable: a predicate deciding whether a computed response is kept, responses that are not kept are
+        still shared with the requests that waited for them
+        :return: a tuple of the response and how it was obtained, 'hit', 'miss' or 'coalesced'
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, 'hit'
+
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            return pending.get(), 'coalesced'
+
+        pending = self.in_flight[key] = AsyncResult()
+        try:
+            value = compute()
+        except BaseException as err:
+            pending.set_exception(err)
+            raise
+        finally:
+            del self.in_flight[key]
+        if cacheable(value):
+            self.put(key, value)
+        pending.set(value)
+        return value, 'miss'
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def key(body, contenttype, accept):
+    """
+    :param body: the request body bytes
+    :param contenttype: the request's Content-Type
+    :param accept: the Content-Type the response will be encoded as
+    :return: a cache key identifying the request
+    """
+    return hashlib.sha256(body).digest(), contenttype, accept
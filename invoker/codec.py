@@ -0,0 +1,361 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+REGISTRY = {}
+
+
+class Codec(object):
+    """A Codec converts between payload bytes and the values a function consumes and produces
+    """
+
+    # when a client accepts several types equally, the codec with the lowest cost is chosen
+    cost = 10
+
+    def decode(self, data, contenttype):
+        """
+        :param data: the payload bytes
+        :param contenttype: the payload's Content-Type, including any parameters
+        :return: the function argument
+        """
+        raise NotImplementedError()
+
+    def encode(self, value, contenttype):
+        """
+        :param value: a function result
+        :param contenttype: the Content-Type of the response, including any parameters
+        :return: a bytes-like object
+        """
+        raise NotImplementedError()
+
+
+class BytesCodec(Codec):
+    """
+    Binary payloads are handed over as read, without decoding or copying. A dict or list result is serialized as
+    JSON, any other result as its str().
+    """
+
+    def decode(self, data, contenttype):
+        return data
+
+    def encode(self, value, contenttype):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return _bytes(value)
+        return _text(value).encode(charset(contenttype))
+
+
+class TextCodec(Codec):
+    """
+    Text payloads are decoded to str using the charset parameter, UTF-8 by default. A dict or list result is
+    serialized as JSON, any other result as its str().
+    """
+
+    def decode(self, data, contenttype):
+        return bytes(data).decode(charset(contenttype))
+
+    def encode(self, value, contenttype):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return _bytes(value)
+        return _text(value).encode(charset(contenttype))
+
+
+def _bytes(value):
+    # the length of a memoryview counts its items, the response must be sized and sent in bytes
+    if isinstance(value, memoryview) and (value.ndim != 1 or value.itemsize != 1):
+        return value.cast('B') if value.c_contiguous else value.tobytes()
+    return value
+
+
+def _text(value):
+    # a client negotiating a text type for a structured result gets JSON rather than a Python repr
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value)
+    return str(value)
+
+
+class JsonCodec(Codec):
+    """
+    JSON payloads are parsed straight from the payload bytes. A str result is assumed to be serialized already,
+    any other result is serialized as JSON.
+    """
+
+    cost = 5
+
+    def decode(self, data, contenttype):
+        return json.loads(data)
+
+    def encode(self, value, contenttype):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return _bytes(value)
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        return value.encode(charset(contenttype))
+
+
+class MsgPackCodec(Codec):
+    """
+    MessagePack, a compact binary alternative to JSON. The msgpack package is used when it is installed,
+    otherwise a pure Python implementation of the core types (nil, bool, int, float, str, bin, array and map).
+    """
+
+    cost = 1
+
+    def decode(self, data, contenttype):
+        if msgpack is not None:
+            return msgpack.unpackb(data, raw=False)
+        value, offset = _unpack(memoryview(data), 0)
+        if offset != len(data):
+            raise ValueError("%d extra bytes after MessagePack value" % (len(data) - offset))
+        return value
+
+    def encode(self, value, contenttype):
+        if msgpack is not None:
+            return msgpack.packb(value, use_bin_type=True)
+        out = bytearray()
+        _pack(value, out)
+        return out
+
+
+def register(mimetype, codec):
+    """
+    Register a Codec, replacing any Codec already registered for the type
+    :param mimetype: a media type such as application/json, or a wildcard such as text/*
+    :param codec: the Codec
+    :return: None
+    """
+    REGISTRY[mimetype.lower()] = codec
+
+
+def mimetype_of(contenttype):
+    return contenttype.split(';', 1)[0].strip().lower()
+
+
+def lookup(contenttype):
+    """
+    :param contenttype: a Content-Type header value
+    :return: the Codec for the type. Types registered exactly take precedence over +json and +xml suffixes, which
+    take precedence over wildcards such as text/*. Anything else is treated as binary.
+    """
+    mimetype = mimetype_of(contenttype)
+    if mimetype in REGISTRY:
+        return REGISTRY[mimetype]
+    if mimetype.endswith('+json'):
+        return REGISTRY['application/json']
+    if mimetype.endswith('+xml'):
+        return REGISTRY['application/xml']
+    wildcard = mimetype.split('/', 1)[0] + '/*'
+    if wildcard in REGISTRY:
+        return REGISTRY[wildcard]
+    return BYTES
+
+
+def parameter(contenttype, name, default=None):
+    """
+    :param contenttype: a Content-Type header value
+    :param name: the name of a parameter such as charset
+    :return: the parameter's value, or the default if the parameter is absent
+    """
+    for param in contenttype.split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == name:
+            return value.strip().strip('"')
+    return default
+
+
+def charset(contenttype):
+    return parameter(contenttype, 'charset', 'UTF-8')
+
+
+def negotiate(accept, default):
+    """
+    Choose the Content-Type of a response
+    :param accept: the request's Accept header value, or None
+    :param default: the Content-Type to use when the client accepts anything, usually the request's Content-Type
+    :return: the acceptable registered type with the highest quality, and the lowest codec cost among equals
+    """
+    if not accept:
+        return default
+
+    candidates = []
+    for entry in accept.split(','):
+        params = entry.split(';')
+        mimetype = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality <= 0 or not mimetype:
+            continue
+        if mimetype == '*/*' or (mimetype.endswith('/*') and mimetype_of(default).startswith(mimetype[:-1])):
+            candidates.append((-quality, lookup(default).cost, default))
+        elif '*' not in mimetype and (mimetype in REGISTRY or lookup(mimetype) is not BYTES):
+            # types resolve as in lookup(), by suffix and wildcard, skipping those that would only fall back to binary
+            candidates.append((-quality, lookup(mimetype).cost, entry.split(';', 1)[0].strip()))
+
+    if not candidates:
+        # nothing acceptable is supported, answer in the request's type rather than refuse
+        return default
+    return min(candidates, key=lambda candidate: candidate[:2])[2]
+
+
+def _pack(value, out):
+    if value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -0x20 <= value < 0:
+            out += struct.pack('>b', value)
+        elif 0 <= value < 1 << 64:
+            for code, fmt, bits in ((0xcc, '>B', 8), (0xcd, '>H', 16), (0xce, '>I', 32), (0xcf, '>Q', 64)):
+                if value < 1 << bits:
+                    out.append(code)
+                    out += struct.pack(fmt, value)
+                    break
+        elif -(1 << 63) <= value < 0:
+            for code, fmt, bits in ((0xd0, '>b', 8), (0xd1, '>h', 16), (0xd2, '>i', 32), (0xd3, '>q', 64)):
+                if value >= -(1 << (bits - 1)):
+                    out.append(code)
+                    out += struct.pack(fmt, value)
+                    break
+        else:
+            raise OverflowError("integer %d is too large for MessagePack" % value)
+    elif isinstance(value, float):
+        out.append(0xcb)
+        out += struct.pack('>d', value)
+    elif isinstance(value, str):
+        data = value.encode('UTF-8')
+        _pack_length(len(data), out, 0xa0, 32, (0xd9, 0xda, 0xdb))
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        value = _bytes(value)
+        _pack_length(len(value), out, None, 0, (0xc4, 0xc5, 0xc6))
+        out += value
+    elif isinstance(value, (list, tuple)):
+        _pack_length(len(value), out, 0x90, 16, (None, 0xdc, 0xdd))
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        _pack_length(len(value), out, 0x80, 16, (None, 0xde, 0xdf))
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    else:
+        raise TypeError("%s is not MessagePack serializable" % type(value).__name__)
+
+
+def _pack_length(length, out, fixcode, fixlimit, codes):
+    if length < fixlimit:
+        out.append(fixcode | length)
+        return
+    for code, fmt, bits in zip(codes, ('>B', '>H', '>I'), (8, 16, 32)):
+        if code is not None and length < 1 << bits:
+            out.append(code)
+            out += struct.pack(fmt, length)
+            return
+    raise OverflowError("length %d is too large for MessagePack" % length)
+
+
+_FIXED = {
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d',
+}
+
+# code: (length format, kind)
+_SIZED = {
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+}
+
+
+def _unpack(data, offset):
+    code = data[offset]
+    offset += 1
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+    if code in _FIXED:
+        fmt = _FIXED[code]
+        return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+
+    if 0xa0 <= code <= 0xbf:
+        kind, length = 'str', code & 0x1f
+    elif 0x90 <= code <= 0x9f:
+        kind, length = 'array', code & 0x0f
+    elif 0x80 <= code <= 0x8f:
+        kind, length = 'map', code & 0x0f
+    elif code in _SIZED:
+        fmt, kind = _SIZED[code]
+        length = struct.unpack_from(fmt, data, offset)[0]
+        offset += struct.calcsize(fmt)
+    else:
+        raise ValueError("unsupported MessagePack type 0x%02x" % code)
+
+    if kind == 'str':
+        return str(data[offset:offset + length], 'UTF-8'), offset + length
+    if kind == 'bin':
+        return bytes(data[offset:offset + length]), offset + length
+    if kind == 'array':
+        items = []
+        for _ in range(length):
+            item, offset = _unpack(data, offset)
+            items.append(item)
+        return items, offset
+    result = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset)
+        result[key], offset = _unpack(data, offset)
+    return result, offset
+
+
+BYTES = BytesCodec()
+TEXT = TextCodec()
+JSON = JsonCodec()
+MSGPACK = MsgPackCodec()
+
+register('text/*', TEXT)
+register('application/xml', TEXT)
+register('application/javascript', TEXT)
+register('application/x-www-form-urlencoded', TEXT)
+register('application/json', JSON)
+register('application/msgpack', MSGPACK)
+register('application/x-msgpack', MSGPACK)
+register('application/octet-stream', BYTES)
@@ -0,0 +1,220 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Content-Encoding of request and response bodies. Compressed request bodies are decompressed as the function reads
+# them, and responses are compressed for clients that accept it. zlib releases the GIL, so large bodies are
+# compressed on the hub's threadpool while the server's thread goes on serving other requests.
+
+import zlib
+
+import gevent
+
+ENCODINGS = ('gzip', 'deflate')
+CHUNK_SIZE = 1 << 16
+
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+class DecompressionError(ValueError):
+    """Raised when a request body is not valid for its Content-Encoding"""
+
+
+class Compressor(object):
+    """Compresses responses for clients that send a matching Accept-Encoding
+    """
+
+    def __init__(self, min_size=1024, level=6, offload_size=1 << 18):
+        """
+        :param min_size: the size in bytes below which a response is sent uncompressed
+        :param level: the zlib compression level, from 1 (fastest) to 9 (smallest)
+        :param offload_size: the size in bytes from which a response is compressed on the threadpool, None to always
+        compress on the server's thread
+        """
+        if not 0 <= level <= 9:
+            raise ValueError("compression level must be between 0 and 9")
+        self.min_size = min_size
+        self.level = level
+        self.offload_size = offload_size
+
+    @classmethod
+    def from_env(cls, env):
+        """
+        :param env: a dict containing the runtime environment, usually os.environ
+        :return: a Compressor configured by COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL and COMPRESSION_OFFLOAD_SIZE,
+        or None if COMPRESSION is false
+        """
+        if env.get('COMPRESSION', 'true').lower() in ('0', 'false', 'no'):
+            return None
+        return cls(min_size=int(env.get('COMPRESSION_MIN_SIZE', 1024)),
+                   level=int(env.get('COMPRESSION_LEVEL', 6)),
+                   offload_size=int(env.get('COMPRESSION_OFFLOAD_SIZE', 1 << 18)) or None)
+
+    def compress(self, body, encoding):
+        """
+        :param body: a list of bytes
+        :param encoding: 'gzip' or 'deflate'
+        :return: the compressed body as a list of bytes, or None if the body is too small to be worth compressing
+        """
+        size = sum(len(chunk) for chunk in body)
+        if size < self.min_size:
+            return None
+        if self.offload_size is not None and size >= self.offload_size:
+            return [gevent.get_hub().threadpool.apply(_compress, (body, encoding, self.level))]
+        return [_compress(body, encoding, self.level)]
+
+    def compress_stream(self, chunks, encoding):
+        """
+        Compress a streamed body, flushing after each chunk so that the client can decompress every frame as soon
+        as it arrives
+        :param chunks: an iterable of bytes
+        :param encoding: 'gzip' or 'deflate'
+        :return: a generator of compressed bytes
+        """
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, _WBITS[encoding])
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+def negotiate(accept_encoding):
+    """
+    :param accept_encoding: a request's Accept-Encoding header value, or None
+    :return: the encoding the client prefers among ENCODINGS, gzip on a tie, or None if it accepts neither
+    """
+    qualities = {}
+    for entry in (accept_encoding or '').split(','):
+        token, _, params = entry.partition(';')
+        token = token.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if token:
+            qualities[token] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def decompress(stream, encoding):
+    """
+    :param stream: a file-like object such as wsgi.input
+    :param encoding: the body's Content-Encoding, 'gzip' or 'deflate'
+    :return: a file-like object reading the decompressed body
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("unsupported Content-Encoding %s" % encoding)
+    return DecompressingReader(stream, encoding)
+
+
+class DecompressingReader(object):
+    """Reads a compressed stream as its decompressed bytes, decompressing no more than the reader asks for at once
+    """
+
+    def __init__(self, stream, encoding):
+        """
+        :param stream: a file-like object
+        :param encoding: 'gzip' or 'deflate'
+        """
+        self.stream = stream
+        self.encoding = encoding
+        self.decompressor = None
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        """
+        :param size: the number of bytes to read, negative to read to the end of the body
+        :return: up to size bytes, fewer only at the end of the body
+        """
+        while (size is None or size < 0 or len(self.buffer) < size) and self._fill(size):
+            pass
+        return self._take(len(self.buffer) if size is None or size < 0 else size)
+
+    def readline(self, size=-1):
+        """
+        :param size: the maximum number of bytes to read, negative for no limit
+        :return: the next line including its line feed, or the rest of the body if it has no line feed
+        """
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                end += 1
+                break
+            if 0 <= size <= len(self.buffer) or not self._fill(CHUNK_SIZE):
+                end = len(self.buffer)
+                break
+        return self._take(end if size is None or size < 0 else min(end, size))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def _take(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def _fill(self, size):
+        # decompress the next piece of the body into the buffer, limiting the output so that a small compressed
+        # body cannot expand into memory all at once. Returns False at the end of the body.
+        if self.eof:
+            return False
+        limit = max(size, CHUNK_SIZE) if size is not None and size >= 0 else CHUNK_SIZE
+        data = self.decompressor.unconsumed_tail if self.decompressor is not None else b''
+        if not data:
+            data = self.stream.read(CHUNK_SIZE)
+            if not data:
+                self.eof = True
+                if self.decompressor is not None:
+                    self.buffer += self.decompressor.flush()
+                    if not self.decompressor.eof:
+                        raise DecompressionError("truncated %s body" % self.encoding)
+                return False
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj(_wbits(self.encoding, data))
+        try:
+            self.buffer += self.decompressor.decompress(data, limit)
+        except zlib.error as err:
+            raise DecompressionError("invalid %s body: %s" % (self.encoding, err))
+        if self.decompressor.eof:
+            self.eof = True
+        return True
+
+
+def _wbits(encoding, data):
+    if encoding == 'deflate' and not _is_zlib_header(data):
+        # some clients send raw deflate data rather than the zlib format HTTP specifies
+        return -zlib.MAX_WBITS
+    return _WBITS[encoding]
+
+
+def _is_zlib_header(data):
+    return len(data) >= 2 and data[0] & 0x0f == zlib.DEFLATED and (data[0] << 8 | data[1]) % 31 == 0
+
+
+def _compress(body, encoding, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    return b''.join([compressor.compress(chunk) for chunk in body] + [compressor.flush()])
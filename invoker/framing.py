@@ -0,0 +1,107 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import struct
+
+from invoker import codec
+
+# one JSON value per line
+NDJSON = 'application/x-ndjson'
+# each frame is a 4 byte big-endian length followed by the payload, whose type is given by the type parameter
+LENGTH_PREFIXED = 'application/x-length-prefixed'
+# Server-Sent Events, output only
+EVENT_STREAM = 'text/event-stream'
+
+_LENGTH = struct.Struct('>I')
+
+
+def is_framed(contenttype):
+    """
+    :param contenttype: a Content-Type header value
+    :return: True if a body of this type carries a sequence of messages
+    """
+    return codec.mimetype_of(contenttype) in (NDJSON, LENGTH_PREFIXED)
+
+
+def negotiate(accept):
+    """
+    :param accept: a request's Accept header value, or None
+    :return: the first framed type the client accepts, or None if it accepts none
+    """
+    for entry in (accept or '').split(','):
+        if codec.mimetype_of(entry) in (EVENT_STREAM, NDJSON, LENGTH_PREFIXED):
+            return entry.strip()
+    return None
+
+
+def frame_type(contenttype):
+    """
+    :param contenttype: the Content-Type of a framed body
+    :return: the Content-Type of each frame's payload
+    """
+    if codec.mimetype_of(contenttype) in (NDJSON, EVENT_STREAM):
+        return 'application/json'
+    return codec.parameter(contenttype, 'type', 'application/octet-stream')
+
+
+def read_frames(stream, contenttype):
+    """
+    Read and decode frames one at a time, as the function asks for them
+    :param stream: a file-like object such as wsgi.input
+    :param contenttype: the Content-Type of the framed body
+    :return: a generator of decoded payloads
+    """
+    payload_type = frame_type(contenttype)
+    payload_codec = codec.lookup(payload_type)
+
+    if codec.mimetype_of(contenttype) == NDJSON:
+        for line in iter(stream.readline, b''):
+            if line.strip():
+                yield payload_codec.decode(line, payload_type)
+        return
+
+    while True:
+        header = stream.read(_LENGTH.size)
+        if not header:
+            return
+        header = _read_exactly(stream, _LENGTH.size, header)
+        yield payload_codec.decode(_read_exactly(stream, _LENGTH.unpack(header)[0]), payload_type)
+
+
+def write_frame(value, contenttype):
+    """
+    :param value: a function result
+    :param contenttype: the Content-Type of the framed body
+    :return: the encoded frame
+    """
+    payload_type = frame_type(contenttype)
+    payload = codec.lookup(payload_type).encode(value, payload_type)
+
+    mimetype = codec.mimetype_of(contenttype)
+    if mimetype == NDJSON:
+        return bytes(payload) + b'\n'
+    if mimetype == EVENT_STREAM:
+        return b''.join(b'data: ' + line + b'\n' for line in bytes(payload).split(b'\n')) + b'\n'
+    return _LENGTH.pack(len(payload)) + bytes(payload)
+
+
+def _read_exactly(stream, length, data=b''):
+    while len(data) < length:
+        more = stream.read(length - len(data))
+        if not more:
+            raise ValueError("truncated frame, expected %d bytes but read %d" % (length, len(data)))
+        data += more
+    return data
@@ -19,25 +19,57 @@ __author__ = 'David Turanski'
 import sys
 import os
 import zipfile
+import compileall
+import hashlib
+import tempfile
 import importlib
+import inspect
 import ntpath
 import os.path
+import re
+import time
+from itertools import islice
 from urllib.parse import urlparse
-from shutil import copyfile
+from shutil import copyfile, rmtree
 
+import gevent
+from gevent.pool import Pool
+from gevent.queue import Empty
+from gevent.threadpool import ThreadPool
+
+from invoker import aio
+from invoker import codec
+from invoker import compression
 from invoker import http_server
+from invoker import spool
+from invoker.admission import AdmissionController
 
 
 def run(function_invoker, env):
     """
     Start an http Server to serve the function
-    :param function_invoker: a function object that can be invoked with invoke()
+    :param function_invoker: a function object that can be invoked with invoke(), or a dict of them by path
     :param env: a dict containing the runtime environment, usually os.environ
     :return: None
     """
 
     port = int(env.get("PORT", 8080))
-    http_server.run(function_invoker=function_invoker, port=port)
+    workers = int(env.get("WORKERS", 1))
+    if isinstance(function_invoker, dict):
+        for route in function_invoker.values():
+            route.warm_up()
+        # each route admits its own invocations
+        admission = {path: AdmissionController.from_env(env) for path in function_invoker}
+    else:
+        function_invoker.warm_up()
+        admission = AdmissionController.from_env(env)
+    slow_request_ms = int(env.get('SLOW_REQUEST_MS', 0))
+    framed = env.get('SOCKET_PATH') or (int(env['SOCKET_PORT']) if env.get('SOCKET_PORT') else None)
+    http_server.run(function_invoker=function_invoker, port=port, workers=workers, admission=admission,
+                    profiling=env.get('PROFILING', '').lower() in ('1', 'true', 'yes'),
+                    server_timing=env.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes'),
+                    slow_request=slow_request_ms / 1000.0 if slow_request_ms > 0 else None,
+                    compressor=compression.Compressor.from_env(env), framed=framed)
 
 
 def stop():
@@ -48,34 +80,291 @@ class FunctionInvoker(object):
     """The Function Invoker provides an object for calling functions
     """
 
-    def __init__(self, func, interaction_model):
+    def __init__(self, func, interaction_model, batch_size=1, batch_wait=0, executor='greenlet', pool_size=1,
+                 warmup=(), cache=None, concurrency=None, ordered=True, payload=None,
+                 spool_threshold=spool.DEFAULT_THRESHOLD):
         """
         :param: func callable function
-        :param interaction_model function's interaction model request_response or stream
+        :param interaction_model function's interaction model request_response, stream or batch
+        :param batch_size the maximum number of messages passed to a batch function at once
+        :param batch_wait the maximum time in seconds to wait for a batch to fill
+        :param executor 'greenlet' to call the function on the gevent hub's thread or 'threadpool' to call it on a
+        pool of native threads
+        :param pool_size the number of native threads used by the threadpool executor
+        :param warmup payloads to invoke the function with before serving
+        :param cache the configuration of a cache of responses, a dict with optional max_entries and ttl keys
+        :param concurrency the maximum number of invocations of a request/response function in flight at once, by
+        default one at a time with the greenlet executor, pool_size with the threadpool executor, and no limit for
+        coroutines
+        :param ordered whether invoke() yields results in the order of its arguments when invoking concurrently,
+        rather than as they complete
+        :param payload None to pass a request/response function the decoded request body, or 'file', 'mmap' or 'items'
+        to spool the body to a temporary file and pass a view of it
+        :param spool_threshold the size in bytes above which a spooled body is written to disk
         """
         self.interaction_model = interaction_model
         self.func = func
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.is_coroutine = inspect.iscoroutinefunction(func)
+        self.is_async_generator = inspect.isasyncgenfunction(func)
+        if executor not in ('greenlet', 'threadpool'):
+            raise ValueError("unknown executor %s" % executor)
+        self.executor = executor
+        self.pool_size = pool_size
+        self._threadpool = None
+        self.warmup = list(warmup)
+        self.cache = cache
+        self.concurrency = concurrency
+        self.ordered = ordered
+        if payload is not None and payload not in spool.MODES:
+            raise ValueError("unknown payload %s" % payload)
+        self.payload = payload
+        self.spool_threshold = spool_threshold
 
     @property
     def name(self):
         return self.func.__name__
 
-    def invoke_async(self, iterator, output):
+    @property
+    def is_source(self):
+        return is_source(self.func)
+
+    def warm_up(self):
+        """
+        Invoke the function with each of the warm-up payloads, discarding the results, so that lazy imports,
+        models loaded on first use and caches are ready before the first request
+        :return: None
+        """
+        if not self.warmup or self.is_source:
+            return
+        start = time.time()
+        try:
+            for _ in self.invoke(iter(self.warmup)):
+                pass
+        except Exception as err:
+            sys.stderr.write("warm-up failed: %r\n" % err)
+            return
+        sys.stdout.write("Warmed up with %d payloads in %.3fs\n" % (len(self.warmup), time.time() - start))
+
+    def invoke_async(self, channel):
+        """
+        Invoke the function on each Message taken from the channel, filling in the Message's result slot
+        :param channel: a Queue of Message objects
+        :return: None
+        """
+        if is_source(self.func):
+            self._invoke_source(channel)
+        elif self.interaction_model == "stream":
+            self._invoke_stream(channel)
+        elif self.interaction_model == "batch":
+            self._invoke_batch(channel)
+        else:
+            self._invoke_messages(channel)
+
+    def _invoke_messages(self, channel):
+        if self.concurrency or self.executor == 'threadpool':
+            # keep every invocation slot (or thread) busy, but take no more messages than can be invoked at once,
+            # so that a slow message does not hold up those behind it
+            pool = Pool(self.concurrency or self.pool_size)
+            for message in channel:
+                pool.spawn(self._invoke_message, message)
+        elif self.is_coroutine:
+            # coroutines spend their time waiting on the event loop, let them overlap
+            for message in channel:
+                gevent.spawn(self._invoke_message, message)
+        else:
+            for message in channel:
+                self._invoke_message(message)
+
+    def _invoke_message(self, message):
+        message.start()
         try:
-            for result in self.invoke(iterator):
-                output.put(result, timeout=30)
+            message.result.set(self._call(message.payload))
         except Exception as err:
-            output.put(err, timeout=30)
+            message.result.set_exception(err)
+
+    def _call(self, arg):
+        if self.is_coroutine:
+            return aio.run(self.func(arg))
+        if self.executor == 'threadpool':
+            return self.threadpool.apply(self.func, (arg,))
+        return self.func(arg)
+
+    @property
+    def threadpool(self):
+        # a gevent ThreadPool belongs to the hub, and so the thread and process, that created it
+        pool = self._threadpool
+        if pool is None or pool.hub is not gevent.get_hub() or pool.pid != os.getpid():
+            self._threadpool = ThreadPool(self.pool_size)
+        return self._threadpool
+
+    def _source(self):
+        if self.is_async_generator:
+            return aio.iterate(self.func())
+        return self.func()
+
+    def _invoke_source(self, channel):
+        """each Message receives the next item produced by the source, or None once it is exhausted"""
+        results = self._source()
+        for message in channel:
+            message.start()
+            try:
+                message.result.set(next(results, None))
+            except Exception as err:
+                message.result.set_exception(err)
+
+    def _invoke_stream(self, channel):
+        """
+        A stream function may produce fewer (or more) results than it consumes. Each result is given to the
+        Message most recently consumed; a Message that is consumed without producing a result is answered with
+        None once the function asks for its next input. An error fails the current Message and restarts the stream.
+        """
+        while True:
+            correlator = _Correlator(channel)
+            try:
+                for result in self.invoke(correlator.payloads()):
+                    correlator.resolve(result)
+            except Exception as err:
+                correlator.fail(err)
+                continue
+
+            correlator.resolve(None)
+            # the function has stopped consuming, answer anything still arriving
+            for message in channel:
+                message.result.set(None)
+
+    def _invoke_batch(self, channel):
+        """
+        Gather up to batch_size Messages, waiting at most batch_wait for more to arrive after the first,
+        and scatter the function's results back to them in order
+        """
+        while True:
+            batch = [channel.get()]
+            deadline = time.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(channel.get(timeout=max(deadline - time.time(), 0)))
+                except Empty:
+                    break
+
+            try:
+                results = self._call_batch([message.start().payload for message in batch])
+            except Exception as err:
+                for message in batch:
+                    message.result.set_exception(err)
+                continue
+
+            for message, result in zip(batch, results):
+                message.result.set(result)
+
+    def _call_batch(self, args):
+        results = list(self._call(args))
+        if len(results) != len(args):
+            raise ValueError("batch function returned %d results for %d arguments" % (len(results), len(args)))
+        return results
 
     def invoke(self, iterator):
         """invoke the function"""
 
         if is_source(self.func):
-            return self.func()
+            return self._source()
         elif self.interaction_model == "stream":
+            if self.is_async_generator:
+                return aio.iterate(self.func(aio.aiter(iterator)))
             return self.func(iterator)
+        elif self.interaction_model == "batch":
+            batches = iter(lambda: list(islice(iterator, self.batch_size)), [])
+            return (result for batch in batches for result in self._call_batch(batch))
+        elif self.concurrency and self.concurrency > 1:
+            return _raise_errors(self._map(iterator, self.ordered))
+        else:
+            return (self._call(arg) for arg in iterator)
+
+    def invoke_each(self, iterator):
+        """
+        Invoke a request/response or batch function on each argument, carrying on past arguments it fails on
+        :param iterator: an iterator of arguments
+        :return: a generator of an (error, result) pair for each argument in order, the error None on success
+        """
+        if self.interaction_model == "batch":
+            return self._attempt_batches(iterator)
+        elif self.concurrency and self.concurrency > 1:
+            return self._map(iterator, True)
         else:
-            return (self.func(arg) for arg in iterator)
+            return (self._attempt(arg) for arg in iterator)
+
+    def _map(self, iterator, ordered):
+        """call the function on up to concurrency arguments at once, yielding an (error, result) pair for each"""
+        failed = []
+
+        def arguments():
+            # an error reading the arguments is raised once the arguments read so far have been invoked, rather
+            # than reported as a failed greenlet of the pool
+            try:
+                for arg in iterator:
+                    yield arg
+            except Exception as err:
+                failed.append(err)
+
+        pool = Pool(self.concurrency)
+        mapper = pool.imap if ordered else pool.imap_unordered
+        for pair in mapper(self._attempt, arguments(), maxsize=self.concurrency):
+            yield pair
+        if failed:
+            raise failed[0]
+
+    def _attempt(self, arg):
+        # an error is raised to the caller of invoke() rather than reported as a failed greenlet
+        try:
+            return None, self._call(arg)
+        except Exception as err:
+            return err, None
+
+    def _attempt_batches(self, iterator):
+        # a failed batch fails each of its arguments
+        for batch in iter(lambda: list(islice(iterator, self.batch_size)), []):
+            try:
+                pairs = [(None, result) for result in self._call_batch(batch)]
+            except Exception as err:
+                pairs = [(err, None)] * len(batch)
+            for pair in pairs:
+                yield pair
+
+
+def _raise_errors(pairs):
+    for err, result in pairs:
+        if err is not None:
+            raise err
+        yield result
+
+
+class _Correlator(object):
+    """Tracks the Message whose payload a stream function consumed most recently"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.current = None
+
+    def payloads(self):
+        while True:
+            self.resolve(None)
+            self.current = self.channel.get().start()
+            yield self.current.payload
+
+    def resolve(self, result):
+        # a second result for an already answered Message has no caller left to receive it
+        if self.current is not None:
+            self.current.result.set(result)
+            self.current = None
+
+    def fail(self, err):
+        if self.current is None:
+            # the function failed without consuming anything, fail the next Message rather than spin
+            self.current = self.channel.get()
+        self.current.result.set_exception(err)
+        self.current = None
+
 
 def install_function(env):
     """
@@ -83,53 +372,164 @@ def install_function(env):
     :param env:  a dict containing the runtime environment, usually os.environ
     :return: a function invoker object that can invoke functions
     """
-    try:
-        function_uri = env['FUNCTION_URI']
-        url = urlparse(function_uri)
-        if url.scheme == 'file':
-            if not os.path.isfile(url.path):
-                sys.stderr.write("file %s does not exist\n" % url.path)
-                exit(1)
-
-            filename, extension = os.path.splitext(url.path)
+    if 'FUNCTION_URI' not in env:
+        sys.stderr.write("required environment variable FUNCTION_URI is missing\n")
+        exit(1)
+    return install_handler(env['FUNCTION_URI'], env)
 
-            if extension == '.zip':
-                zip_ref = zipfile.ZipFile(url.path, 'r')
-                zip_ref.extractall('.')
-                zip_ref.close()
-                sys.stdout.write("Files extracted\n")
-            elif extension == '.py':
-                if not os.path.isfile(url.path):
-                    copyfile(url.path, ('./%s' % ntpath.basename(url.path)))
 
-        else:
-            sys.stderr.write("scheme %s is not supported\n" % url.scheme)
+def install_routes(env):
+    """
+    Install each of the functions given by FUNCTION_ROUTES, a list of path=uri entries separated by whitespace or
+    commas, where each uri is given as for FUNCTION_URI, for example
+    /upper=file:///functions/upper.py?handler=handle /window=file:///functions/windows.py?handler=sliding
+    :param env:  a dict containing the runtime environment, usually os.environ
+    :return: a dict of function invoker objects by path
+    """
+    routes = {}
+    modules = {}
+    for entry in re.split(r'[\s,]+', env.get('FUNCTION_ROUTES', '').strip()):
+        path, _, function_uri = entry.partition('=')
+        if not path.startswith('/') or not function_uri:
+            sys.stderr.write("FUNCTION_ROUTES entry %r is not of the form /path=uri\n" % entry)
             exit(1)
+        routes[path.rstrip('/') or '/'] = install_handler(function_uri, env, modules)
+    return routes
+
 
-        indx = len('handler=')
-        if len(url.query) <= indx or url.query[0:indx] != 'handler=':
-            sys.stderr.write("FUNCTION_URI missing handler\n")
+def install_handler(function_uri, env, modules=None):
+    """
+    :param function_uri: the function's location and handler, such as file:///functions/upper.py?handler=handle
+    :param env:  a dict containing the runtime environment, usually os.environ
+    :param modules: the modules installed so far by name, a module's codecs and init() are set up only once
+    :return: a function invoker object that can invoke the handler
+    """
+    modules = {} if modules is None else modules
+    url = urlparse(function_uri)
+    if url.scheme == 'file':
+        if not os.path.isfile(url.path):
+            sys.stderr.write("file %s does not exist\n" % url.path)
             exit(1)
 
-        handler = url.query[indx:]
-        if extension == '.py' and '.' not in handler:
-            func_name = handler
-            mod_name = ntpath.basename(filename)
-        else:
-            mod_name, func_name = handler.rsplit('.', 1)
+        filename, extension = os.path.splitext(url.path)
 
-        mod = importlib.import_module(mod_name)
-        return FunctionInvoker(getattr(mod, func_name), getattr(mod, 'interaction_model', None))
+        if extension == '.zip':
+            sys.path.insert(0, install_archive(url.path, env))
+        elif extension == '.py':
+            if not os.path.isfile(url.path):
+                copyfile(url.path, ('./%s' % ntpath.basename(url.path)))
 
-    except KeyError:
-        sys.stderr.write("required environment variable FUNCTION_URI is missing\n")
+    else:
+        sys.stderr.write("scheme %s is not supported\n" % url.scheme)
+        exit(1)
+
+    indx = len('handler=')
+    if len(url.query) <= indx or url.query[0:indx] != 'handler=':
+        sys.stderr.write("FUNCTION_URI missing handler\n")
         exit(1)
 
+    handler = url.query[indx:]
+    if extension == '.py' and '.' not in handler:
+        func_name = handler
+        mod_name = ntpath.basename(filename)
+    else:
+        mod_name, func_name = handler.rsplit('.', 1)
+
+    mod = modules.get(mod_name)
+    if mod is None:
+        mod = modules[mod_name] = importlib.import_module(mod_name)
+        precompile(mod)
+        for mimetype, function_codec in getattr(mod, 'codecs', {}).items():
+            codec.register(mimetype, function_codec)
+        if callable(getattr(mod, 'init', None)):
+            mod.init()
+
+    func = getattr(mod, func_name)
+    # a handler may declare its own interaction model, for modules with handlers of several kinds
+    return FunctionInvoker(func, getattr(func, 'interaction_model', getattr(mod, 'interaction_model', None)),
+                           batch_size=int(env.get('BATCH_SIZE', 64)),
+                           batch_wait=int(env.get('BATCH_WAIT_MS', 10)) / 1000.0,
+                           executor=env.get('EXECUTOR', 'greenlet'),
+                           pool_size=int(env.get('POOL_SIZE', os.cpu_count() or 1)),
+                           warmup=getattr(mod, 'warmup', ()),
+                           cache=getattr(mod, 'cache', None),
+                           concurrency=int(env.get('CONCURRENCY', getattr(mod, 'concurrency', 0))) or None,
+                           ordered=getattr(mod, 'ordered', True),
+                           payload=getattr(mod, 'payload', None),
+                           spool_threshold=int(env.get('SPOOL_THRESHOLD', spool.DEFAULT_THRESHOLD)))
+
+
+def precompile(mod):
+    """
+    Compile the bytecode of the function's package, or of the modules next to a plain module, so that modules the
+    function imports lazily are not compiled while serving the first requests
+    :param mod: the function module
+    :return: None
+    """
+    package = importlib.import_module(mod.__name__.split('.', 1)[0])
+    location = getattr(package, '__file__', None)
+    if not location or not os.path.isdir(os.path.dirname(location)):
+        # a namespace package, or a module imported from an archive
+        return
+    if hasattr(package, '__path__'):
+        compileall.compile_dir(os.path.dirname(location), quiet=2)
+    else:
+        compileall.compile_dir(os.path.dirname(location), maxlevels=0, quiet=2)
+
+
+def install_archive(path, env):
+    """
+    Make the contents of a function archive importable. Unless ZIP_IMPORT is set, the archive is extracted and
+    compiled once into a directory of ARCHIVE_CACHE named by the archive's SHA-256, which later starts and other
+    processes sharing the cache reuse.
+    :param path: the path of the zip archive
+    :param env: a dict containing the runtime environment, usually os.environ
+    :return: the directory, or archive, to add to sys.path
+    """
+    if env.get('ZIP_IMPORT', '').lower() in ('1', 'true', 'yes'):
+        # zipimport reads modules straight from the archive
+        return path
+
+    cache = env.get('ARCHIVE_CACHE', os.path.join(tempfile.gettempdir(), 'riff-functions'))
+    target = os.path.join(cache, archive_digest(path))
+    if os.path.isdir(target):
+        sys.stdout.write("Using files extracted to %s\n" % target)
+        return target
+
+    os.makedirs(cache, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=cache, prefix='.extract-')
+    try:
+        with zipfile.ZipFile(path, 'r') as zip_ref:
+            zip_ref.extractall(staging)
+        compileall.compile_dir(staging, ddir=target, quiet=1)
+        # the rename is atomic, a directory named by its digest is always complete
+        os.rename(staging, target)
+        sys.stdout.write("Files extracted to %s\n" % target)
+    except OSError:
+        if not os.path.isdir(target):
+            raise
+        # another process extracted the same archive first
+    finally:
+        if os.path.isdir(staging):
+            rmtree(staging, ignore_errors=True)
+    return target
+
+
+def archive_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as archive:
+        for block in iter(lambda: archive.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 def is_source(func):
     return func.__code__.co_argcount == 0
 
 
 if __name__ == '__main__':
-    function_invoker = install_function(os.environ)
+    if os.environ.get('FUNCTION_ROUTES'):
+        function_invoker = install_routes(os.environ)
+    else:
+        function_invoker = install_function(os.environ)
     run(function_invoker, os.environ)
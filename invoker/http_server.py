@@ -15,66 +15,533 @@ Copyright 2019 the original author or authors.
 '''
 
 import gevent
+import io
 import json
-from gevent.queue import Queue, Empty
-from gevent.pywsgi import WSGIServer
+import signal
+import socket
+import sys
+import threading
+import time
+from itertools import chain, islice
+from urllib.parse import parse_qs
+from gevent.queue import Queue, Full
+from gevent.pywsgi import WSGIServer, WSGIHandler
+
+from invoker import cache
+from invoker import codec
+from invoker import compression
+from invoker import framing
+from invoker import metrics
+from invoker import prefork
+from invoker import profiler
+from invoker import socket_server
+from invoker import spool
+from invoker import state
+from invoker.admission import AdmissionController
+from invoker.message import Message
 
 SERVER = None
+READY = False
+QUEUE_SIZE = 50
+_END = object()
 CORRELATION_ID_HEADER = 'correlationId'
+METRICS_PATH = '/metrics'
+READY_PATH = '/ready'
+PROFILE_PATH = '/debug/profile'
+
+
+class NoDelayWSGIHandler(WSGIHandler):
+    """Response headers and body are written separately, Nagle's algorithm must not hold back the body until the
+    client's delayed ACK of the headers arrives"""
 
+    def handle(self):
+        if self.socket.family in (socket.AF_INET, socket.AF_INET6):
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super(NoDelayWSGIHandler, self).handle()
 
-def run(function_invoker, port):
-    output_channel = Queue(maxsize=50)
-    input_channel = Queue(maxsize=50)
 
-    gevent.spawn(function_invoker.invoke_async, input_channel, output_channel)
+def run(function_invoker, port, workers=1, admission=None, profiling=False, server_timing=False, slow_request=None,
+        compressor=None, framed=None):
+    """
+    Serve the function over http
+    :param function_invoker: the FunctionInvoker to serve on every path, or a dict of FunctionInvokers by the path
+    they serve, including the paths below it
+    :param port: the port to listen on
+    :param workers: the number of worker processes, each accepting on the same listening socket
+    :param admission: the AdmissionController limiting each process's invocations, by default a 100ms queue wait.
+    With routes, a dict of AdmissionControllers by path.
+    :param profiling: serve samples of the server's stacks on PROFILE_PATH
+    :param server_timing: send the time spent in each stage of a request in a Server-Timing header
+    :param slow_request: log the stages of requests that take at least this many seconds, None to log none
+    :param compressor: the Compressor of responses to clients that accept a compressed encoding, None to send
+    responses uncompressed
+    :param framed: the path of a Unix domain socket, or a TCP port, to also serve the function on with the framed
+    transport of socket_server, None to serve http only
+    :return: None
+    """
+    if framed is not None:
+        if isinstance(function_invoker, dict):
+            raise ValueError("the framed transport serves a single function, not routes")
+        framed = socket_server.listen(framed)
+    if workers > 1:
+        # bind before forking so that every worker accepts on the inherited socket
+        listener = WSGIServer.get_listener(('', port), family=socket.AF_INET)
+        prefork.supervise(workers, lambda: serve(function_invoker, listener, admission, profiling, server_timing,
+                                                 slow_request, compressor, framed))
+    else:
+        serve(function_invoker, ('', port), admission, profiling, server_timing, slow_request, compressor, framed)
+
+
+def serve(function_invoker, listener, admission=None, profiling=False, server_timing=False, slow_request=None,
+          compressor=None, framed=None):
+    if isinstance(function_invoker, dict):
+        admissions = admission if isinstance(admission, dict) else {}
+        routes = {path: route(invoker, admissions.get(path), path, server_timing, slow_request, compressor)
+                  for path, invoker in function_invoker.items()}
+    else:
+        # a single function serves every path, its metrics are not labelled with a route
+        routes = {'': route(function_invoker, admission, '', server_timing, slow_request, compressor)}
 
     def invoke(environ, start_response):
+        if environ['PATH_INFO'] == METRICS_PATH and environ['REQUEST_METHOD'] == 'GET':
+            start_response('200 OK', [('Content-Type', metrics.CONTENT_TYPE)])
+            return [metrics.render()]
+        if environ['PATH_INFO'] == READY_PATH and environ['REQUEST_METHOD'] == 'GET':
+            start_response('200 OK' if READY else '503 SERVICE UNAVAILABLE', [('Content-Type', 'text/plain')])
+            return [b'true' if READY else b'false']
+        if profiling and environ['PATH_INFO'] == PROFILE_PATH and environ['REQUEST_METHOD'] == 'GET':
+            return profile(environ, start_response)
 
-        body = parse_function_arguments(environ)
-        input_channel.put(body, timeout=30)
+        app = find_route(routes, environ['PATH_INFO'])
+        if app is None:
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+            return [b'No function at ' + environ['PATH_INFO'].encode()]
+
+        encoding = (http_header('Content-Encoding', environ) or 'identity').strip().lower()
+        if encoding != 'identity':
+            if encoding not in compression.ENCODINGS:
+                start_response('415 UNSUPPORTED MEDIA TYPE', [('Content-Type', 'text/plain'),
+                                                               ('Accept-Encoding', ', '.join(compression.ENCODINGS))])
+                return [b'Unsupported Content-Encoding: ' + encoding.encode()]
+            # the body is decompressed as it is read, so that framed and spooled bodies still stream
+            environ['wsgi.input'] = compression.decompress(environ['wsgi.input'], encoding)
+        try:
+            return app(environ, start_response)
+        except compression.DecompressionError as err:
+            # the body was read before anything was sent, unless the response has started and this re-raises
+            start_response('400 BAD REQUEST', [('Content-Type', 'text/plain')], sys.exc_info())
+            return [b'Invalid request body: ' + str(err).encode()]
 
-        status = '200 OK'
+    global SERVER, READY
+    SERVER = WSGIServer(listener, application=metrics.instrument(invoke), handler_class=NoDelayWSGIHandler)
+    framed_server = socket_server.serve(function_invoker, framed) if framed is not None else None
+    # the function has been installed and warmed up before the server starts listening
+    READY = True
+    if threading.current_thread() is threading.main_thread():
+        # stop serving on SIGTERM rather than exit straight away, so that keyed state is checkpointed
+        gevent.signal_handler(signal.SIGTERM, stop)
+    try:
+        SERVER.serve_forever()
+    finally:
+        if framed_server is not None:
+            framed_server.stop()
+        state.close_all()
 
-        contenttype = content_type(environ)
-        headers = [
-            ('Content-Type', contenttype)
-        ]
 
+def route(function_invoker, admission, name, server_timing=False, slow_request=None, compressor=None):
+    """
+    :param function_invoker: the FunctionInvoker to route requests to
+    :param admission: the AdmissionController for the function's invocations, by default a 100ms queue wait
+    :param name: the route's path, which labels its metrics
+    :param server_timing: send the time spent in each stage of a request in a Server-Timing header
+    :param slow_request: log the stages of requests that take at least this many seconds, None to log none
+    :param compressor: the Compressor of responses, None to send responses uncompressed
+    :return: a WSGI application invoking the function, with its own input queue
+    """
+    admission = admission or AdmissionController()
+
+    queue_size = QUEUE_SIZE
+    if function_invoker.interaction_model == 'batch':
+        # a batch must be able to fill from the channel
+        queue_size = max(queue_size, function_invoker.batch_size)
+    input_channel = Queue(maxsize=queue_size)
+
+    gevent.spawn(function_invoker.invoke_async, input_channel)
+
+    metrics.QUEUE_DEPTH.set_function(input_channel.qsize, name)
+    metrics.QUEUE_CAPACITY.labels(name).set(input_channel.maxsize)
+    metrics.CONCURRENCY_LIMIT.set_function(lambda: int(admission.limit), name)
+    # expose the route's counters from the start, as for metrics without labels
+    for metric in (metrics.INVOCATION_SECONDS, metrics.INVOCATION_ERRORS, metrics.QUEUE_TIMEOUTS):
+        metric.labels(name)
+
+    # request/response and batch functions that are passed decoded payloads can be invoked on many at once
+    bulk = function_invoker.interaction_model != 'stream' and not function_invoker.is_source and \
+        function_invoker.payload is None
+
+    response_cache = None
+    if function_invoker.interaction_model != 'stream' and not function_invoker.is_source:
+        response_cache = cache.ResponseCache.from_config(function_invoker.cache)
+        if response_cache is not None:
+            metrics.CACHE_ENTRIES.set_function(lambda: len(response_cache), name)
+
+    def invoke(environ, start_response):
+        if function_invoker.interaction_model == 'stream' and framing.is_framed(content_type(environ)):
+            return invoke_stream(function_invoker, environ, start_response, compressor)
+        if function_invoker.is_source and framing.negotiate(http_header('Accept', environ)):
+            return invoke_source(function_invoker, environ, start_response, compressor)
+        if bulk and is_bulk(environ):
+            return invoke_bulk(function_invoker, environ, start_response, admission, name, compressor)
+
+        start = time.time()
+        timings = Timings()
         correlationid = http_header(CORRELATION_ID_HEADER, environ)
-        if correlationid is not None:
-            headers.append((CORRELATION_ID_HEADER, correlationid))
+        if response_cache is None:
+            status, contenttype, headers, body = admit(environ, correlationid, timings)
+        else:
+            # the body has to be read to find the cached response, even if the request is then rejected
+            data = environ['wsgi.input'].read()
+            timings.stage('read', start)
+            accept = codec.negotiate(http_header('Accept', environ), content_type(environ))
+            (status, contenttype, headers, body), outcome = response_cache.get_or_compute(
+                cache.key(data, content_type(environ), accept),
+                lambda: admit(environ, correlationid, timings, data),
+                cacheable=lambda reply: reply[0] == '200 OK')
+            metrics.CACHE_REQUESTS.labels(name, outcome).inc()
+            timings.cache = outcome
 
+        headers = response_headers(contenttype, correlationid) + headers
+        if compressor is not None and status == '200 OK':
+            # the cache holds uncompressed responses, which serve clients whatever encoding they accept
+            headers.append(('Vary', 'Accept-Encoding'))
+            encoding = compression.negotiate(http_header('Accept-Encoding', environ))
+            compress = time.time()
+            compressed = compressor.compress(body, encoding) if encoding is not None else None
+            if compressed is not None:
+                body = compressed
+                headers.append(('Content-Encoding', encoding))
+                timings.stage('compress', compress)
+        duration = timings.stage('total', start) - start
+        if server_timing:
+            headers.append(('Server-Timing', timings.header()))
+        if slow_request is not None and duration >= slow_request:
+            log_slow_request(environ, status, correlationid, name, timings)
         start_response(status, headers)
+        return body
 
+    def admit(environ, correlationid, timings, data=None):
+        # reject before reading the body, a rejection should cost as little as possible
+        if not admission.acquire():
+            return rejection('429 TOO MANY REQUESTS', 'concurrency', admission, name)
+
+        start = time.time()
+        try:
+            return invoke_message(environ, correlationid, timings, data)
+        finally:
+            admission.release(time.time() - start)
+
+    def invoke_message(environ, correlationid, timings, data):
+        """:return: a tuple of the status, Content-Type, additional headers and body of the response"""
+        start = time.time()
+        if function_invoker.payload is None:
+            if data is None:
+                data = environ['wsgi.input'].read()
+                start = timings.stage('read', start)
+            message = Message(parse_function_arguments(environ, data), correlationid)
+            return invoke_argument(environ, message, timings, timings.stage('decode', start))
+
+        stream = environ['wsgi.input'] if data is None else io.BytesIO(data)
+        try:
+            spooled = spool.Spooled(stream, content_type(environ), function_invoker.payload,
+                                    function_invoker.spool_threshold)
+        except spool.UnsupportedPayload as err:
+            return '415 UNSUPPORTED MEDIA TYPE', 'text/plain', [], [str(err).encode()]
+        try:
+            # the temporary file lives until the response is encoded, the result may be a view of it. It is
+            # deleted before the encoded response is written.
+            message = Message(spooled.argument, correlationid)
+            return invoke_argument(environ, message, timings, timings.stage('read', start))
+        finally:
+            spooled.close()
+
+    def invoke_argument(environ, message, timings, start):
+        try:
+            input_channel.put(message, timeout=admission.queue_wait)
+        except Full:
+            metrics.QUEUE_TIMEOUTS.labels(name).inc()
+            timings.stage('queue', start)
+            return rejection('503 SERVICE UNAVAILABLE', 'queue_wait', admission, name)
+
+        contenttype = codec.negotiate(http_header('Accept', environ), content_type(environ))
         try:
-            # yield to spawned greenlet
-            gevent.sleep()
-            val = output_channel.get_nowait()
-            if val == StopIteration:
-                return
-            elif isinstance(val, Exception):
-                start_response('500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain')])
-                yield response("Error Invoking Function: " + repr(val), 'text/plain')
-            else:
-                yield response(val, contenttype)
-        except Empty:
-            return
-
-    global SERVER
-    options = None
-    SERVER = WSGIServer(('', port), application=invoke)  # , log=None)
-    SERVER.serve_forever()
+            val = message.result.get()
+        except Exception as err:
+            metrics.INVOCATION_ERRORS.labels(name).inc()
+            return '500 INTERNAL SERVER ERROR', 'text/plain', [], [response(error_message(err), 'text/plain')]
+        finally:
+            metrics.INVOCATION_SECONDS.labels(name).observe(time.time() - start)
+            if message.started is not None:
+                timings.stage('queue', start, message.started)
+                timings.stage('invoke', message.started)
+
+        if val is None:
+            return '200 OK', contenttype, [], []
+        encode = time.time()
+        body = [response(val, contenttype)]
+        timings.stage('encode', encode)
+        return '200 OK', contenttype, [], body
+
+    return invoke
+
+
+def find_route(routes, path):
+    """
+    :param routes: WSGI applications by path, '' for an application serving every path
+    :param path: a request path
+    :return: the application for the longest route that is the path or one of its parents, or None
+    """
+    while path not in routes:
+        if path in ('', '/'):
+            return routes.get('')
+        path = path.rsplit('/', 1)[0] or '/'
+    return routes[path]
+
+
+def invoke_stream(function_invoker, environ, start_response, compressor=None):
+    """
+    Feed the frames of a framed request body to a new invocation of a stream function as they arrive, and send
+    each result back as a frame of a chunked response while the rest of the body is still being read
+    """
+    contenttype = content_type(environ)
+    correlationid = http_header(CORRELATION_ID_HEADER, environ)
+    results = function_invoker.invoke(framing.read_frames(environ['wsgi.input'], contenttype))
+
+    # wait for the first result, so that a function failing straight away can still be answered with an error
+    try:
+        first = next(results, _END)
+    except compression.DecompressionError:
+        # the request is at fault rather than the function
+        raise
+    except Exception as err:
+        start_response('500 INTERNAL SERVER ERROR', response_headers('text/plain', correlationid))
+        return [response(error_message(err), 'text/plain')]
+
+    if first is _END:
+        start_response('200 OK', response_headers(contenttype, correlationid))
+        return []
+    frames = (framing.write_frame(result, contenttype) for result in chain([first], results))
+    headers, frames = compress_stream(compressor, environ, response_headers(contenttype, correlationid), frames)
+    start_response('200 OK', headers)
+    return frames
+
+
+def invoke_source(function_invoker, environ, start_response, compressor=None):
+    """
+    Send the output of a new invocation of a source function as a chunked response of frames, optionally limited
+    by a limit query parameter. The source is only advanced once the previous frame has been written to the socket,
+    so a client that stops reading stops production.
+    """
+    contenttype = framing.negotiate(http_header('Accept', environ))
+    correlationid = http_header(CORRELATION_ID_HEADER, environ)
+    limit = parse_qs(environ.get('QUERY_STRING', '')).get('limit')
+
+    results = function_invoker.invoke(iter(()))
+    if limit:
+        results = islice(results, int(limit[0]))
+
+    headers = response_headers(contenttype, correlationid)
+    if codec.mimetype_of(contenttype) == framing.EVENT_STREAM:
+        headers.append(('Cache-Control', 'no-cache'))
+    headers, frames = compress_stream(compressor, environ, headers,
+                                      (framing.write_frame(result, contenttype) for result in results))
+    start_response('200 OK', headers)
+    return frames
+
+
+def is_bulk(environ):
+    """:return: True if the request's body is NDJSON, or a JSON array with a bulk query parameter"""
+    if codec.mimetype_of(content_type(environ)) == framing.NDJSON:
+        return True
+    bulk = parse_qs(environ.get('QUERY_STRING', '')).get('bulk')
+    return bool(bulk) and bulk[0].lower() in ('1', 'true', 'yes')
+
+
+def invoke_bulk(function_invoker, environ, start_response, admission, name='', compressor=None):
+    """
+    Invoke a request/response or batch function on each item of a bulk request, and answer with an NDJSON line for
+    each item in order, {"result": ...} or {"error": ...}, so that a failed item does not fail the others. Items are
+    read, invoked and answered as they arrive, and the whole request is admitted as one invocation.
+    """
+    correlationid = http_header(CORRELATION_ID_HEADER, environ)
+    if not admission.acquire():
+        status, contenttype, headers, body = rejection('429 TOO MANY REQUESTS', 'concurrency', admission, name)
+        start_response(status, response_headers(contenttype, correlationid) + headers)
+        return body
+
+    start = time.time()
+    try:
+        results = function_invoker.invoke_each(bulk_items(environ))
+        # invoke the first item before answering, so that a body that is not a batch can still be rejected
+        first = next(results, _END)
+    except ValueError as err:
+        admission.release(time.time() - start)
+        start_response('400 BAD REQUEST', response_headers('text/plain', correlationid))
+        return [b'Invalid bulk request: ' + str(err).encode()]
+    except BaseException:
+        admission.release(time.time() - start)
+        raise
+
+    lines = bulk_lines(chain([first], results) if first is not _END else iter(()), admission, name, start)
+    headers, lines = compress_stream(compressor, environ, response_headers(framing.NDJSON, correlationid), lines)
+    start_response('200 OK', headers)
+    return lines
+
+
+def bulk_items(environ):
+    """:return: a generator of the decoded items of a bulk request's body"""
+    stream = environ['wsgi.input']
+    if codec.mimetype_of(content_type(environ)) == framing.NDJSON:
+        return framing.read_frames(stream, framing.NDJSON)
+    return spool.iter_json_array(stream)
+
+
+def bulk_lines(pairs, admission, name, start):
+    """
+    :param pairs: (error, result) pairs of a bulk request's items
+    :return: a generator of an NDJSON line for each pair, ending with an error line if the rest of the body is invalid.
+    A result is encoded as it would be for a single application/json request, so that a str or bytes result is
+    taken to be serialized already.
+    """
+    try:
+        for err, result in pairs:
+            if err is None:
+                try:
+                    line = b'{"result": ' + bytes(response(result, 'application/json')) + b'}\n'
+                except (TypeError, ValueError) as encode_err:
+                    err = encode_err
+            if err is not None:
+                metrics.INVOCATION_ERRORS.labels(name).inc()
+                line = (json.dumps({'error': error_message(err)}) + '\n').encode()
+            yield line
+    except ValueError as err:
+        # the items before the invalid one have been answered, the status can no longer change
+        yield (json.dumps({'error': 'Invalid bulk request: %s' % err}) + '\n').encode()
+    finally:
+        seconds = time.time() - start
+        metrics.INVOCATION_SECONDS.labels(name).observe(seconds)
+        admission.release(seconds)
+
+
+def compress_stream(compressor, environ, headers, frames):
+    """
+    :param compressor: the Compressor of responses, or None
+    :param environ: the request's environ
+    :param headers: the response headers
+    :param frames: a generator of the response's frames
+    :return: a tuple of the headers and the frames, compressed frame by frame if the client accepts an encoding
+    """
+    encoding = compression.negotiate(http_header('Accept-Encoding', environ)) if compressor is not None else None
+    if encoding is None:
+        return headers, frames
+    return headers + [('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')], \
+        compressor.compress_stream(frames, encoding)
+
+
+def profile(environ, start_response):
+    """
+    Sample the stacks of the server's threads for the number of seconds given by the seconds query parameter
+    (default 10), every interval_ms milliseconds (default 10), and answer with the samples in the collapsed stack
+    format
+    """
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    try:
+        seconds = float(query.get('seconds', ['10'])[0])
+        interval = float(query.get('interval_ms', ['10'])[0]) / 1000.0
+        samples = profiler.profile(seconds, interval)
+    except ValueError as err:
+        start_response('400 BAD REQUEST', [('Content-Type', 'text/plain')])
+        return [str(err).encode()]
+    except profiler.Busy as err:
+        start_response('409 CONFLICT', [('Content-Type', 'text/plain')])
+        return [str(err).encode()]
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [samples]
+
+
+class Timings(object):
+    """The time spent in each stage of a request, in the order the stages ended"""
+
+    def __init__(self):
+        self.stages = []
+        self.cache = None
+
+    def stage(self, name, start, end=None):
+        """
+        :param name: the stage's name
+        :param start: the time the stage started
+        :param end: the time the stage ended, by default now
+        :return: the time the stage ended
+        """
+        end = time.time() if end is None else end
+        self.stages.append((name, end - start))
+        return end
+
+    def header(self):
+        """:return: the stages as a Server-Timing header value, in milliseconds"""
+        entries = ['%s;dur=%.3f' % (name, seconds * 1000) for name, seconds in self.stages]
+        if self.cache is not None:
+            entries.insert(0, 'cache;desc=%s' % self.cache)
+        return ', '.join(entries)
+
+
+def log_slow_request(environ, status, correlationid, name, timings):
+    """write a line of JSON describing a slow request and the time spent in each of its stages to stderr"""
+    entry = {
+        'event': 'slow_request',
+        'correlationId': correlationid,
+        'path': environ.get('PATH_INFO'),
+        'status': int(status.split(' ', 1)[0]),
+        'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in timings.stages},
+    }
+    if name:
+        entry['route'] = name
+    if timings.cache is not None:
+        entry['cache'] = timings.cache
+    sys.stderr.write(json.dumps(entry) + '\n')
+
+
+def rejection(status, reason, admission, name=''):
+    """:return: the response to a request that was not admitted, without invoking the function"""
+    metrics.REJECTED.labels(name, reason).inc()
+    return status, 'text/plain', [('Retry-After', str(admission.retry_after))], \
+        [b'Function Invoker Overloaded: ' + reason.encode()]
+
+
+def response_headers(contenttype, correlationid):
+    headers = [
+        ('Content-Type', contenttype)
+    ]
+    if correlationid is not None:
+        headers.append((CORRELATION_ID_HEADER, correlationid))
+    return headers
+
+
+def error_message(err):
+    return "Error Invoking Function: " + repr(err)
 
 
 def http_header(name, env):
-    key = "HTTP_%s" % name.upper()
+    key = "HTTP_%s" % name.upper().replace('-', '_')
     return env.get(key, None)
 
 
 def stop():
-    global SERVER
-    SERVER.stop()
+    global SERVER, READY
+    READY = False
+    if prefork.WORKERS:
+        prefork.stop()
+    else:
+        SERVER.stop()
 
 
 def content_type(env):
@@ -84,16 +551,12 @@ def content_type(env):
 # When the method is POST the variable will be sent
 # in the HTTP request body which is passed by the WSGI server
 # in the 'wsgi.input' environment variable.
-def parse_function_arguments(env):
-    body = env['wsgi.input'].read().decode()
-    if content_type(env).startswith('application/json'):
-        return json.loads(body)
-    return body
+def parse_function_arguments(env, data=None):
+    contenttype = content_type(env)
+    if data is None:
+        data = env['wsgi.input'].read()
+    return codec.lookup(contenttype).decode(data, contenttype)
 
 
 def response(val, contenttype):
-    if type(val) == dict and contenttype.startswith('application/json'):
-        resp = json.dumps(val)
-    else:
-        resp = val
-    return bytearray(resp, 'UTF-8')
+    return codec.lookup(contenttype).encode(val, contenttype)
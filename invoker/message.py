@@ -0,0 +1,47 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import time
+from itertools import count
+
+from gevent.event import AsyncResult
+
+_sequence = count()
+
+
+class Message(object):
+    """A function argument paired with the result slot its caller is waiting on
+    """
+
+    def __init__(self, payload, correlation_id=None):
+        """
+        :param payload: the decoded function argument
+        :param correlation_id: the caller's correlationId, if any
+        """
+        self.id = next(_sequence)
+        self.payload = payload
+        self.correlation_id = correlation_id
+        self.result = AsyncResult()
+        # the time the function took the message, which ends its wait in the queue
+        self.started = None
+
+    def start(self):
+        """record that the function has taken the message"""
+        self.started = time.time()
+        return self
+
+    def __repr__(self):
+        return "Message(id=%d, correlation_id=%r)" % (self.id, self.correlation_id)
@@ -0,0 +1,301 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Metrics in the Prometheus text exposition format. Metrics are updated by greenlets on the hub's thread,
+# which never preempt each other, so plain attribute updates are enough and no locking is needed.
+
+import time
+from bisect import bisect_left
+
+from invoker import codec
+from invoker import framing
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+REGISTRY = []
+
+
+class _Value(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class _Function(object):
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name, labels, self.function()
+
+
+class _Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts[i] holds observations in (buckets[i-1], buckets[i]], the last one those above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield name + '_bucket', labels + (('le', _format(bound)),), cumulative
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, cumulative
+
+
+class Metric(object):
+    """A named family of values, one per combination of label values
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        """
+        :param name: the metric name
+        :param documentation: the HELP text
+        :param labelnames: the names of the metric's labels
+        :param registry: the list the metric is exposed from
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        if not self.labelnames:
+            # a metric without labels is exposed from the start
+            self.labels()
+        registry.append(self)
+
+    def labels(self, *labelvalues):
+        """
+        :param labelvalues: a value for each label name
+        :return: the value for the combination of labels
+        """
+        child = self.children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError("%s expects labels %s" % (self.name, self.labelnames))
+            child = self.children[labelvalues] = self._child()
+        return child
+
+    def _child(self):
+        return _Value()
+
+    def samples(self):
+        for labelvalues, child in sorted(self.children.items()):
+            for sample in child.samples(self.name, tuple(zip(self.labelnames, labelvalues))):
+                yield sample
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function, *labelvalues):
+        """report the value returned by function when the metrics are collected"""
+        self.children[labelvalues] = _Function(function)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+
+    def _child(self):
+        return _Histogram(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+def render(registry=REGISTRY):
+    """
+    :param registry: the metrics to expose
+    :return: the metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in registry:
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for name, labels, value in metric.samples():
+            # an empty label value is the same as no label, such as the route of an invoker serving one function
+            labels = tuple((label, label_value) for label, label_value in labels if label_value != '')
+            if labels:
+                name += '{%s}' % ','.join('%s="%s"' % (label, _escape(label_value)) for label, label_value in labels)
+            lines.append('%s %s' % (name, _format(value)))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def instrument(app):
+    """
+    Wrap a WSGI application to record request counts, latency, in-flight requests and bytes in and out
+    :param app: a WSGI application
+    :return: the instrumented WSGI application
+    """
+
+    def instrumented(environ, start_response):
+        start = time.time()
+        contenttype = content_type_label(environ.get('CONTENT_TYPE', ''))
+        status = []
+
+        def _start_response(value, headers, exc_info=None):
+            status[:] = [value.split(' ', 1)[0]]
+            return start_response(value, headers, exc_info)
+
+        # bytes are counted as received, before a compressed body is decompressed
+        received = environ['wsgi.input'] = _CountingInput(environ['wsgi.input'])
+        REQUESTS_IN_FLIGHT.inc()
+
+        def done():
+            REQUESTS_IN_FLIGHT.dec()
+            RECEIVED_BYTES.inc(received.count)
+            REQUESTS.labels(contenttype, status[0] if status else '500').inc()
+            REQUEST_SECONDS.observe(time.time() - start)
+
+        try:
+            result = app(environ, _start_response)
+        except BaseException:
+            done()
+            raise
+
+        if isinstance(result, list):
+            # keep the list, the server sets Content-Length for a single item list
+            SENT_BYTES.inc(sum(len(data) for data in result))
+            done()
+            return result
+        return _counting(result, done)
+
+    return instrumented
+
+
+def content_type_label(contenttype):
+    """
+    :param contenttype: a request's Content-Type header value
+    :return: its media type if a codec is registered for exactly that type, or it is text/plain or a framing, ''
+    if there is none, otherwise 'other', so that clients cannot add label values without bound
+    """
+    mimetype = codec.mimetype_of(contenttype)
+    if not mimetype or mimetype in _LABELLED or ('*' not in mimetype and mimetype in codec.REGISTRY):
+        return mimetype
+    return 'other'
+
+
+class _CountingInput(object):
+    """A wsgi.input that counts the bytes read through it"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.count += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.count += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def _counting(result, done):
+    try:
+        for data in result:
+            SENT_BYTES.inc(len(data))
+            yield data
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+        done()
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# types counted under their own label besides those registered exactly, text/plain only matches text/*
+_LABELLED = ('text/plain', framing.NDJSON, framing.LENGTH_PREFIXED, framing.EVENT_STREAM)
+
+REQUESTS = Counter('invoker_requests_total', 'HTTP requests by request content type and response status',
+                   ('content_type', 'status'))
+REQUEST_SECONDS = Histogram('invoker_request_duration_seconds', 'HTTP request latency, until the last byte is sent')
+REQUESTS_IN_FLIGHT = Gauge('invoker_requests_in_flight', 'HTTP requests being served')
+RECEIVED_BYTES = Counter('invoker_received_bytes_total', 'Request body bytes read')
+SENT_BYTES = Counter('invoker_sent_bytes_total', 'Response body bytes written')
+INVOCATION_SECONDS = Histogram('invoker_invocation_duration_seconds',
+                               'Time from queueing a message to its result, including time spent in the queue',
+                               ('route',))
+INVOCATION_ERRORS = Counter('invoker_invocation_errors_total', 'Invocations that raised an error', ('route',))
+QUEUE_DEPTH = Gauge('invoker_queue_depth', 'Messages waiting in the input queue', ('route',))
+QUEUE_CAPACITY = Gauge('invoker_queue_capacity', 'Size of the input queue', ('route',))
+QUEUE_TIMEOUTS = Counter('invoker_queue_timeouts_total', 'Messages that timed out waiting for room in the input queue',
+                         ('route',))
+CONCURRENCY_LIMIT = Gauge('invoker_concurrency_limit', 'Invocations allowed in flight, 0 for no limit', ('route',))
+REJECTED = Counter('invoker_rejected_requests_total', 'Requests rejected without invoking the function, by reason',
+                   ('route', 'reason'))
+CACHE_REQUESTS = Counter('invoker_cache_requests_total',
+                         'Requests answered through the response cache, by outcome: hit, miss or coalesced',
+                         ('route', 'outcome'))
+CACHE_ENTRIES = Gauge('invoker_cache_entries', 'Responses held in the response cache', ('route',))
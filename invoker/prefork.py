@@ -0,0 +1,99 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import os
+import signal
+import sys
+import time
+
+import gevent
+
+# a worker that dies sooner than this after starting is respawned only after the same delay
+MIN_WORKER_LIFETIME = 1.0
+
+WORKERS = {}
+STOPPING = False
+
+
+def supervise(workers, serve):
+    """
+    Fork worker processes and keep the given number of them running until stopped.
+    Everything loaded before this is called (the function module in particular) is shared copy-on-write.
+    :param workers: the number of worker processes
+    :param serve: a callable run in each worker, it should serve until the worker is told to stop
+    :return: None
+    """
+    global STOPPING
+    STOPPING = False
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    for _ in range(workers):
+        _spawn(serve)
+
+    while WORKERS:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        started = WORKERS.pop(pid, None)
+        if started is None or STOPPING:
+            continue
+
+        sys.stderr.write("worker %d exited with status %d, respawning\n" % (pid, status))
+        if time.time() - started < MIN_WORKER_LIFETIME:
+            time.sleep(MIN_WORKER_LIFETIME)
+        if not STOPPING:
+            _spawn(serve)
+
+
+def stop():
+    global STOPPING
+    STOPPING = True
+    for pid in list(WORKERS):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            WORKERS.pop(pid, None)
+
+
+def _on_signal(signum, frame):
+    stop()
+
+
+def _spawn(serve):
+    pid = os.fork()
+    if pid:
+        WORKERS[pid] = time.time()
+        return
+
+    # the child starts with a fresh event loop and default signal handling
+    WORKERS.clear()
+    status = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        gevent.reinit()
+        serve()
+    except BaseException as err:
+        sys.stderr.write("worker %d failed: %r\n" % (os.getpid(), err))
+        status = 1
+    finally:
+        os._exit(status)
@@ -0,0 +1,104 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# A sampling profiler for a live invoker. A native thread records the stack each thread is executing at a fixed
+# interval, which costs the profiled code nothing between samples. On the server's thread the stack is that of the
+# running greenlet, so samples show where the server spends its time: parsing, invoking, serializing or waiting in
+# the hub for I/O. The result is in the collapsed stack format read by flamegraph.pl and speedscope.
+
+import sys
+import threading
+import time
+from collections import Counter
+
+import gevent
+
+MAX_SECONDS = 60
+DEFAULT_INTERVAL = 0.01
+# sampling more often than this would compete with the server's thread for the GIL
+MIN_INTERVAL = 0.001
+
+_lock = threading.Lock()
+
+
+class Busy(Exception):
+    """Raised when a profile is requested while another is being recorded"""
+
+
+def profile(seconds, interval=DEFAULT_INTERVAL):
+    """
+    Record stack samples of every thread for a while, blocking only the current greenlet
+    :param seconds: the time to sample for, at most MAX_SECONDS
+    :param interval: the time in seconds between samples, at least MIN_INTERVAL
+    :return: the samples in the collapsed stack format, one line of semicolon separated frames and a count per stack
+    """
+    if not seconds > 0:
+        raise ValueError("seconds must be positive, not %r" % seconds)
+    if not interval >= 0:
+        raise ValueError("interval must not be negative, not %r" % interval)
+    interval = max(interval, MIN_INTERVAL)
+    if not _lock.acquire(blocking=False):
+        raise Busy("a profile is already being recorded")
+    try:
+        stacks = gevent.get_hub().threadpool.apply(sample, (min(seconds, MAX_SECONDS), interval))
+    finally:
+        _lock.release()
+    return collapsed(stacks)
+
+
+def sample(seconds, interval=DEFAULT_INTERVAL):
+    """
+    Record stack samples of every thread but the calling one, blocking the calling thread
+    :param seconds: the time to sample for
+    :param interval: the time in seconds between samples
+    :return: a Counter of samples by stack, each stack a tuple of frame names starting with the thread's name
+    """
+    stacks = Counter()
+    me = threading.get_ident()
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                stacks[stack(frame, names.get(ident, 'thread-%d' % ident))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def stack(frame, thread_name):
+    """
+    :param frame: the innermost frame of a stack
+    :param thread_name: the name of the stack's thread
+    :return: a tuple of the thread name and a module.function name for each frame, outermost first
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s.%s' % (frame.f_globals.get('__name__', '?'), getattr(code, 'co_qualname', code.co_name)))
+        frame = frame.f_back
+    names.append(thread_name)
+    names.reverse()
+    return tuple(names)
+
+
+def collapsed(stacks):
+    """
+    :param stacks: a Counter of samples by stack
+    :return: the samples in the collapsed stack format, as bytes
+    """
+    lines = ('%s %d\n' % (';'.join(name.replace(';', ':') for name in frames), count)
+             for frames, count in sorted(stacks.items()))
+    return ''.join(lines).encode('utf-8')
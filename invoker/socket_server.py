@@ -0,0 +1,244 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# A framed transport for callers on the same host, such as a sidecar, over a Unix domain socket or plain TCP. Many
+# invocations and stream sessions share one persistent connection, each frame naming the invocation it belongs to
+# by a correlation id, so that there is no HTTP request to parse per message.
+#
+# Every frame is a 4 byte big-endian length of the rest of the frame, a 1 byte kind, the 2 byte lengths of the
+# correlation id and the content type, then the correlation id, the content type and the payload:
+#
+#   INVOKE  client  invoke the function on the payload, answered with one RESULT or ERROR
+#   RESULT  server  the result of an INVOKE, in the INVOKE's content type
+#   ERROR   server  a failed INVOKE or stream session, the payload is the UTF-8 error message
+#   DATA    both    the next input item of a stream session, opening it, or the next output item
+#   END     both    the end of a stream session's input, or of its output
+
+import os
+import struct
+import sys
+import time
+
+import gevent
+from gevent import socket
+from gevent.lock import Semaphore
+from gevent.queue import Queue
+from gevent.server import StreamServer
+
+from invoker import codec
+from invoker import metrics
+from invoker.message import Message
+
+INVOKE, RESULT, ERROR, DATA, END = 1, 2, 3, 4, 5
+QUEUE_SIZE = 50
+MAX_FRAME = 1 << 30
+DEFAULT_CONTENT_TYPE = 'application/json'
+
+_HEADER = struct.Struct('>IBHH')
+_FIELDS = struct.Struct('>BHH')
+_END_OF_INPUT = object()
+
+
+def listen(address):
+    """
+    Bind the transport's listening socket, before worker processes are forked so that every worker accepts on it
+    :param address: the path of a Unix domain socket, or a TCP port
+    :return: the listening socket
+    """
+    if isinstance(address, str):
+        if os.path.exists(address):
+            # a socket left behind by a previous run
+            os.unlink(address)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('', address))
+    listener.listen(socket.SOMAXCONN)
+    return listener
+
+
+def serve(function_invoker, listener):
+    """
+    Start serving the function on the listener, alongside the http server
+    :param function_invoker: the FunctionInvoker to invoke
+    :param listener: a listening socket made by listen()
+    :return: the started StreamServer
+    """
+    channel = Queue(maxsize=QUEUE_SIZE)
+    gevent.spawn(function_invoker.invoke_async, channel)
+    server = StreamServer(listener, lambda sock, address: Connection(function_invoker, channel, sock).serve())
+    server.start()
+    return server
+
+
+class Connection(object):
+    """A client connection, carrying any number of concurrent invocations and stream sessions
+    """
+
+    def __init__(self, function_invoker, channel, sock):
+        """
+        :param function_invoker: the FunctionInvoker to invoke
+        :param channel: the input channel of Messages for INVOKE frames
+        :param sock: the connected socket
+        """
+        self.function_invoker = function_invoker
+        self.channel = channel
+        self.sock = sock
+        self.sessions = {}
+        # ids of sessions that ended before the client's END, whose further DATA frames are discarded
+        self.ended = set()
+        # frames of concurrent invocations are written whole, one at a time
+        self.write_lock = Semaphore()
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def serve(self):
+        """read frames until the client closes the connection"""
+        stream = self.sock.makefile('rb')
+        try:
+            for kind, correlationid, contenttype, payload in read_frames(stream):
+                if kind == INVOKE:
+                    self.invoke(correlationid, contenttype, payload)
+                elif kind == DATA:
+                    if correlationid not in self.ended:
+                        self.session(correlationid, contenttype).put(payload)
+                elif kind == END:
+                    session = self.sessions.pop(correlationid, None)
+                    if session is not None:
+                        session.put(_END_OF_INPUT)
+                    else:
+                        self.ended.discard(correlationid)
+                else:
+                    raise ValueError("unexpected frame kind %d" % kind)
+        except (ValueError, OSError) as err:
+            sys.stderr.write("closing framed connection: %r\n" % err)
+        finally:
+            # a put can yield to a session that ends and removes itself
+            for session in list(self.sessions.values()):
+                session.put(_END_OF_INPUT)
+            stream.close()
+
+    def invoke(self, correlationid, contenttype, payload):
+        try:
+            message = Message(codec.lookup(contenttype).decode(payload, contenttype), correlationid)
+        except Exception as err:
+            self.write(ERROR, correlationid, 'text/plain', error_message(err))
+            return
+        # waiting for room in the channel holds up the connection's reader, which pushes back on the client
+        self.channel.put(message)
+        gevent.spawn(self.answer, message, contenttype)
+
+    def answer(self, message, contenttype):
+        start = time.time()
+        try:
+            result = message.result.get()
+            self.write(RESULT, message.correlation_id, contenttype, encode(result, contenttype))
+        except Exception as err:
+            metrics.INVOCATION_ERRORS.labels('').inc()
+            self.write(ERROR, message.correlation_id, 'text/plain', error_message(err))
+        finally:
+            metrics.INVOCATION_SECONDS.labels('').observe(time.time() - start)
+
+    def session(self, correlationid, contenttype):
+        """:return: the input queue of the stream session, opening it on its first DATA frame"""
+        session = self.sessions.get(correlationid)
+        if session is None:
+            session = self.sessions[correlationid] = Queue(maxsize=QUEUE_SIZE)
+            gevent.spawn(self.stream, correlationid, contenttype, session)
+        return session
+
+    def stream(self, correlationid, contenttype, session):
+        """invoke the function on the session's input as it arrives, and send each result as it is produced"""
+        payload_codec = codec.lookup(contenttype)
+        items = (payload_codec.decode(payload, contenttype) for payload in iter(session.get, _END_OF_INPUT))
+        try:
+            for result in self.function_invoker.invoke(items):
+                self.write(DATA, correlationid, contenttype, encode(result, contenttype))
+            self.write(END, correlationid, contenttype, b'')
+        except Exception as err:
+            metrics.INVOCATION_ERRORS.labels('').inc()
+            self.write(ERROR, correlationid, 'text/plain', error_message(err))
+        finally:
+            if self.sessions.get(correlationid) is session:
+                # the function stopped before the client's END, drop the rest of its input
+                del self.sessions[correlationid]
+                self.ended.add(correlationid)
+                while not session.empty():
+                    # making room releases the reader if it is waiting to put another frame
+                    session.get_nowait()
+
+    def write(self, kind, correlationid, contenttype, payload):
+        frame = pack(kind, correlationid, contenttype, payload)
+        with self.write_lock:
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                # the client has gone, the reader sees the connection close
+                pass
+
+
+def pack(kind, correlationid, contenttype, payload):
+    """
+    :param kind: the frame's kind, such as INVOKE
+    :param correlationid: the id of the invocation or stream session, str or bytes
+    :param contenttype: the payload's Content-Type
+    :param payload: the payload bytes
+    :return: the encoded frame
+    """
+    if isinstance(correlationid, str):
+        correlationid = correlationid.encode('utf-8')
+    contenttype = contenttype.encode('latin-1')
+    length = _FIELDS.size + len(correlationid) + len(contenttype) + len(payload)
+    return b''.join((_HEADER.pack(length, kind, len(correlationid), len(contenttype)), correlationid, contenttype,
+                     bytes(payload)))
+
+
+def read_frames(stream):
+    """
+    :param stream: a buffered binary file-like object
+    :return: a generator of (kind, correlation id, content type, payload) tuples, the correlation id as str
+    """
+    while True:
+        header = stream.read(_HEADER.size)
+        if not header:
+            return
+        if len(header) < _HEADER.size:
+            raise ValueError("truncated frame header")
+        length, kind, idlength, typelength = _HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise ValueError("frame of %d bytes is too large" % length)
+        size = length - _FIELDS.size
+        if size < idlength + typelength:
+            raise ValueError("frame of %d bytes is too short for its %d byte correlation id and %d byte content type"
+                             % (length, idlength, typelength))
+        body = stream.read(size)
+        if len(body) < size:
+            raise ValueError("truncated frame, expected %d bytes but read %d" % (size, len(body)))
+        correlationid = body[:idlength].decode('utf-8')
+        contenttype = body[idlength:idlength + typelength].decode('latin-1') or DEFAULT_CONTENT_TYPE
+        yield kind, correlationid, contenttype, body[idlength + typelength:]
+
+
+def encode(value, contenttype):
+    if value is None:
+        return b''
+    return codec.lookup(contenttype).encode(value, contenttype)
+
+
+def error_message(err):
+    return ("Error Invoking Function: " + repr(err)).encode('utf-8')
@@ -0,0 +1,171 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Request bodies for functions that handle payloads too large to hold in memory. The body is copied to a temporary
+# file that stays in memory up to a threshold and moves to disk beyond it, and the function receives a view of the
+# file rather than the decoded payload.
+
+import codecs
+import json
+import mmap
+import shutil
+import tempfile
+
+from invoker import codec
+from invoker import framing
+
+MODES = ('file', 'mmap', 'items')
+DEFAULT_THRESHOLD = 1 << 20
+CHUNK_SIZE = 1 << 16
+
+_DELIMITERS = ' \t\r\n,]'
+
+
+class UnsupportedPayload(ValueError):
+    """Raised when a body's Content-Type cannot be passed to the function in the requested mode"""
+
+
+class Spooled(object):
+    """A request body copied to a temporary file, and the argument the function receives for it
+    """
+
+    def __init__(self, stream, contenttype, mode, threshold=DEFAULT_THRESHOLD):
+        """
+        :param stream: a file-like object such as wsgi.input
+        :param contenttype: the body's Content-Type
+        :param mode: 'file' for a seekable binary file, 'mmap' for a read-only buffer of the body, or 'items' for
+        an iterator of the JSON values of an NDJSON body, or of the items of a JSON array
+        :param threshold: the size in bytes above which the body is written to disk rather than kept in memory
+        """
+        if mode not in MODES:
+            raise ValueError("unknown payload mode %s" % mode)
+        # check the type before anything is read or written
+        items = _items_reader(contenttype) if mode == 'items' else None
+        self.file = tempfile.SpooledTemporaryFile(max_size=threshold)
+        self.view = None
+        shutil.copyfileobj(stream, self.file, CHUNK_SIZE)
+        # a spooled file moves to disk once it holds more than the threshold
+        self.on_disk = self.file.tell() > threshold
+        self.file.seek(0)
+
+        if mode == 'file':
+            self.argument = self.file
+        elif mode == 'mmap':
+            self.argument = self.view = self._map()
+        else:
+            self.argument = items(self.file)
+
+    def close(self):
+        """unmap the view and delete the file"""
+        if isinstance(self.view, mmap.mmap):
+            try:
+                self.view.close()
+            except BufferError:
+                # a result still refers to the mapping, it is unmapped once the result is released
+                pass
+        self.file.close()
+
+    def _map(self):
+        if not self.on_disk:
+            return memoryview(self.file.read())
+        self.file.flush()
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _items_reader(contenttype):
+    if codec.mimetype_of(contenttype) == framing.NDJSON:
+        return iter_ndjson
+    if codec.lookup(contenttype) is codec.REGISTRY['application/json']:
+        return iter_json_array
+    raise UnsupportedPayload("an items payload must be %s or a JSON array, not %s" % (framing.NDJSON, contenttype))
+
+
+def iter_ndjson(stream):
+    """
+    :param stream: a binary file-like object holding one JSON value per line
+    :return: a generator of the values, read one line at a time
+    """
+    for line in iter(stream.readline, b''):
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """
+    :param stream: a binary file-like object holding a UTF-8 JSON array
+    :param chunk_size: the number of bytes read at a time
+    :return: a generator of the array's items, parsed as they are read so that only one item is held at once
+    """
+    decoder = json.JSONDecoder()
+    # a chunk may end inside a multi-byte character, the incremental decoder holds on to it
+    decode = codecs.getincrementaldecoder('utf-8')().decode
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        data = stream.read(chunk_size)
+        eof = not data
+        buffer = buffer[position:] + decode(data, final=eof)
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip_whitespace()
+    if position >= len(buffer) or buffer[position] != '[':
+        raise ValueError("expected a JSON array")
+    position += 1
+
+    skip_whitespace()
+    if position < len(buffer) and buffer[position] == ']':
+        return
+
+    while True:
+        skip_whitespace()
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise
+            fill()
+            continue
+        if not eof and _number(item) and (end == len(buffer) or buffer[end] not in _DELIMITERS):
+            # a number may continue in the next chunk, as in 12|34 or 1.5|e3, decode it again once more has been read
+            fill()
+            continue
+        position = end
+        yield item
+
+        skip_whitespace()
+        if position >= len(buffer):
+            raise ValueError("unterminated JSON array")
+        if buffer[position] == ']':
+            return
+        if buffer[position] != ',':
+            raise ValueError("expected ',' or ']' at %r" % buffer[position:position + 20])
+        position += 1
+
+
+def _number(item):
+    return isinstance(item, (int, float)) and not isinstance(item, bool)
@@ -0,0 +1,267 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Keyed state for functions, kept in memory up to a number of entries and spilled to a SQLite file beyond that.
+# Changes are written to the file by periodic checkpoints and when the invoker stops, and a store opened on the
+# same file after a restart reads its entries back as they are used. A function called on the threadpool executor,
+# or a coroutine on the asyncio loop's thread, uses the store from other threads than the server's, so its entries
+# and file are guarded by a lock, and checkpoints are always scheduled on the hub of the thread that opened it.
+#
+#     from invoker import state
+#
+#     totals = state.KeyedState('totals', ttl=24 * 3600)
+#
+#     def handle(event):
+#         return totals.update(event['user'], lambda total: total + event['amount'], 0)
+
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import gevent
+
+STORES = []
+_MISSING = object()
+
+
+class _Entry(object):
+    __slots__ = ('value', 'expires', 'dirty')
+
+    def __init__(self, value, expires, dirty):
+        self.value = value
+        self.expires = expires
+        self.dirty = dirty
+
+
+class KeyedState(object):
+    """A durable mapping of keys to values, for state that must outlive a restart of the invoker
+    """
+
+    def __init__(self, name, directory=None, max_entries=100000, ttl=None, checkpoint_interval=10):
+        """
+        :param name: the store's name, which names its file
+        :param directory: the directory holding the store's file, by default STATE_DIR or ./state
+        :param max_entries: the number of entries kept in memory, the least recently used are spilled to the file
+        :param ttl: the time in seconds an entry is kept after it was last written, None to keep it until deleted
+        :param checkpoint_interval: the time in seconds between checkpoints, None to checkpoint only when stopping
+        """
+        directory = directory or os.environ.get('STATE_DIR', 'state')
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name + '.db')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.checkpoint_interval = checkpoint_interval
+        self.entries = OrderedDict()
+        self.deleted = set()
+        self._checkpointer = None
+        self._checkpoint_scheduled = False
+        self._closed = False
+        self._hub = gevent.get_hub()
+        self._hub_thread = threading.get_ident()
+        self._lock = threading.RLock()
+        self._db = None
+        self._pid = None
+        self._connect()
+        STORES.append(self)
+
+    @property
+    def db(self):
+        # a connection must not be shared with a forked worker process, each process opens its own
+        if self._db is None or self._pid != os.getpid():
+            self._connect()
+        return self._db
+
+    def get(self, key, default=None):
+        """
+        :param key: a str, bytes, int or float key
+        :param default: the value returned when the key has no value
+        :return: the key's value
+        """
+        with self._lock:
+            entry = self._entry(key)
+            return default if entry is None else entry.value
+
+    def put(self, key, value):
+        """
+        :param key: a str, bytes, int or float key
+        :param value: a picklable value
+        :return: None
+        """
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = _Entry(value, expires, True)
+                self.deleted.discard(key)
+                self._spill()
+            else:
+                entry.value, entry.expires, entry.dirty = value, expires, True
+                self.entries.move_to_end(key)
+            self._schedule_checkpoint()
+
+    def update(self, key, function, default=None):
+        """
+        Replace the key's value with function(value)
+        :param key: a str, bytes, int or float key
+        :param function: a callable computing the new value from the current one
+        :param default: the current value when the key has no value
+        :return: the new value
+        """
+        with self._lock:
+            value = function(self.get(key, default))
+            self.put(key, value)
+            return value
+
+    def delete(self, key):
+        """
+        :param key: a str, bytes, int or float key
+        :return: None
+        """
+        with self._lock:
+            self.entries.pop(key, None)
+            self.deleted.add(key)
+            self._schedule_checkpoint()
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        self.delete(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._entry(key) is not None
+
+    def checkpoint(self):
+        """
+        Write the changes made since the last checkpoint to the file, and drop expired entries
+        :return: None
+        """
+        with self._lock:
+            now = time.time()
+            for key in [key for key, entry in self.entries.items() if _expired(entry, now)]:
+                del self.entries[key]
+            dirty = [(key, entry) for key, entry in self.entries.items() if entry.dirty]
+
+            with self.db:
+                self.db.executemany('DELETE FROM state WHERE key = ?', ((key,) for key in self.deleted))
+                self.db.executemany('INSERT OR REPLACE INTO state VALUES (?, ?, ?)',
+                                    ((key, _dumps(entry.value), entry.expires) for key, entry in dirty))
+                self.db.execute('DELETE FROM state WHERE expires <= ?', (now,))
+            self.deleted.clear()
+            for _, entry in dirty:
+                entry.dirty = False
+
+    def close(self):
+        """
+        Checkpoint and close the file
+        :return: None
+        """
+        with self._lock:
+            self._closed = True
+            if self._checkpointer is not None:
+                self._checkpointer.kill(block=False)
+                self._checkpointer = None
+            self.checkpoint()
+            self._db.close()
+            self._db = None
+        if self in STORES:
+            STORES.remove(self)
+
+    def _connect(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._pid = os.getpid()
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS state (key PRIMARY KEY, value BLOB, expires REAL)')
+        self._db.commit()
+
+    def _entry(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            if key in self.deleted:
+                return None
+            row = self.db.execute('SELECT value, expires FROM state WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            entry = self.entries[key] = _Entry(pickle.loads(row[0]), row[1], False)
+            self._spill()
+        else:
+            self.entries.move_to_end(key)
+
+        if _expired(entry, time.time()):
+            self.delete(key)
+            return None
+        return entry
+
+    def _spill(self):
+        # changed entries leaving memory are written to the file, they become durable with the next checkpoint
+        while len(self.entries) > self.max_entries:
+            key, entry = self.entries.popitem(last=False)
+            if entry.dirty:
+                self.db.execute('INSERT OR REPLACE INTO state VALUES (?, ?, ?)',
+                                (key, _dumps(entry.value), entry.expires))
+
+    def _schedule_checkpoint(self):
+        if not self.checkpoint_interval or self._checkpoint_scheduled:
+            return
+        self._checkpoint_scheduled = True
+        if threading.get_ident() == self._hub_thread:
+            self._start_checkpointer()
+        else:
+            # a greenlet spawned here would belong to this thread's hub, which never runs
+            self._hub.loop.run_callback_threadsafe(self._start_checkpointer)
+
+    def _start_checkpointer(self):
+        with self._lock:
+            if not self._closed:
+                self._checkpointer = gevent.spawn_later(self.checkpoint_interval, self._periodic_checkpoint)
+
+    def _periodic_checkpoint(self):
+        with self._lock:
+            self._checkpointer = None
+            self._checkpoint_scheduled = False
+        try:
+            self.checkpoint()
+        except sqlite3.Error as err:
+            sys.stderr.write("state checkpoint of %s failed: %r\n" % (self.path, err))
+
+
+def close_all():
+    """
+    Checkpoint and close every store, called when the invoker stops
+    :return: None
+    """
+    for store in list(STORES):
+        store.close()
+
+
+def _expired(entry, now):
+    return entry.expires is not None and entry.expires <= now
+
+
+def _dumps(value):
+    return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,330 @@
+__copyright__ = '''
+Copyright 2019 the original author or authors.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       https://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+# Windowing operators for stream functions. Each operator consumes the function's input stream and yields one
+# value per window: the items in the window, or with an aggregate, the aggregation of the items, which is kept up
+# to date as items enter and leave the window rather than recomputed over the whole window.
+#
+#     from invoker import windows
+#
+#     def moving_average(stream):
+#         return windows.sliding(stream, 10000, aggregate=windows.Mean)
+
+import time
+from collections import deque
+
+import gevent
+from gevent.queue import Queue, Empty
+
+_END = object()
+_IDLE = object()
+
+
+class Aggregation(object):
+    """An aggregation of the items in a window, updated in constant time as an item enters or leaves it
+    """
+
+    def add(self, item):
+        """
+        :param item: the item entering the window
+        :return: None
+        """
+        raise NotImplementedError()
+
+    def remove(self, item):
+        """
+        :param item: the oldest item in the window, which is leaving it
+        :return: None
+        """
+        raise NotImplementedError()
+
+    @property
+    def value(self):
+        """the aggregation of the items in the window"""
+        raise NotImplementedError()
+
+
+class Count(Aggregation):
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, item):
+        self.count += 1
+
+    def remove(self, item):
+        self.count -= 1
+
+    @property
+    def value(self):
+        return self.count
+
+
+class Sum(Aggregation):
+
+    def __init__(self):
+        self.sum = 0
+
+    def add(self, item):
+        self.sum += item
+
+    def remove(self, item):
+        self.sum -= item
+
+    @property
+    def value(self):
+        return self.sum
+
+
+class Mean(Aggregation):
+    """The mean of the items, None for an empty window"""
+
+    def __init__(self):
+        self.sum = 0
+        self.count = 0
+
+    def add(self, item):
+        self.sum += item
+        self.count += 1
+
+    def remove(self, item):
+        self.sum -= item
+        self.count -= 1
+
+    @property
+    def value(self):
+        return self.sum / self.count if self.count else None
+
+
+class Min(Aggregation):
+    """
+    The smallest item, None for an empty window. A monotonic queue keeps the items that may still become the
+    smallest, so that each item is added and dropped once and removing the oldest item takes amortized constant time.
+    """
+
+    def __init__(self):
+        # (sequence number, item) pairs, items increasing from the front
+        self.candidates = deque()
+        self.added = 0
+        self.removed = 0
+
+    def add(self, item):
+        while self.candidates and not self._before(self.candidates[-1][1], item):
+            self.candidates.pop()
+        self.candidates.append((self.added, item))
+        self.added += 1
+
+    def remove(self, item):
+        if self.candidates and self.candidates[0][0] == self.removed:
+            self.candidates.popleft()
+        self.removed += 1
+
+    @property
+    def value(self):
+        return self.candidates[0][1] if self.candidates else None
+
+    def _before(self, kept, item):
+        return kept < item
+
+
+class Max(Min):
+    """The largest item, None for an empty window"""
+
+    def _before(self, kept, item):
+        return kept > item
+
+
+class Aggregations(Aggregation):
+    """Several aggregations of the same items, whose value is a dict of their values by name"""
+
+    def __init__(self, **aggregations):
+        """
+        :param aggregations: the Aggregations by name, such as sum=Sum(), max=Max()
+        """
+        self.aggregations = aggregations
+
+    def add(self, item):
+        for aggregation in self.aggregations.values():
+            aggregation.add(item)
+
+    def remove(self, item):
+        for aggregation in self.aggregations.values():
+            aggregation.remove(item)
+
+    @property
+    def value(self):
+        return {name: aggregation.value for name, aggregation in self.aggregations.items()}
+
+
+def tumbling(stream, size, aggregate=None):
+    """
+    Windows of size consecutive items that do not overlap. The last window may hold fewer items.
+    :param stream: the input stream
+    :param size: the number of items in a window
+    :param aggregate: a callable returning a new Aggregation, such as Sum, or None for the items themselves
+    :return: a generator yielding a list of the items in each window, or its aggregation
+    """
+    return _windows(stream, size=size, aggregate=aggregate)
+
+
+def sliding(stream, size, step=1, aggregate=None):
+    """
+    Windows of the last size items, one as soon as the first size items have arrived and then one every step items.
+    With step equal to size, the windows are those of tumbling(), without the last partial window.
+    :param stream: the input stream
+    :param size: the number of items in a window
+    :param step: the number of items the window moves by
+    :param aggregate: a callable returning a new Aggregation, such as Mean, or None for the items themselves
+    :return: a generator yielding the window, or its aggregation. The window is a deque that is updated in place
+    as the stream moves on, copy it to keep it beyond the next item.
+    """
+    window = deque(maxlen=size)
+    aggregation = aggregate() if aggregate is not None else None
+    pending = 0
+    for item in stream:
+        if aggregation is not None:
+            if len(window) == size:
+                aggregation.remove(window[0])
+            aggregation.add(item)
+        window.append(item)
+        if len(window) < size:
+            continue
+        # the first full window is emitted, then every step items after it
+        if pending == 0:
+            yield aggregation.value if aggregation is not None else window
+        pending = (pending + 1) % step
+
+
+def timed(stream, duration, size=None, aggregate=None):
+    """
+    Windows of the items that arrive within duration seconds of the first. A window is emitted when its time is up,
+    even if the stream is idle, or when it holds size items. A window emitted on an idle stream only reaches the
+    caller on a framed stream, an HTTP request per message has already been answered by then.
+    :param stream: the input stream
+    :param duration: the length of a window in seconds
+    :param size: the maximum number of items in a window, None for no limit
+    :param aggregate: a callable returning a new Aggregation, or None for the items themselves
+    :return: a generator yielding a list of the items in each window, or its aggregation
+    """
+    return _windows(stream, duration=duration, size=size, aggregate=aggregate)
+
+
+def session(stream, gap, size=None, aggregate=None):
+    """
+    Windows of items separated by less than gap seconds. A window is emitted once no item has arrived for gap
+    seconds, or when it holds size items. A window emitted on an idle stream only reaches the caller on a framed
+    stream, an HTTP request per message has already been answered by then.
+    :param stream: the input stream
+    :param gap: the idle time in seconds that ends a session
+    :param size: the maximum number of items in a window, None for no limit
+    :param aggregate: a callable returning a new Aggregation, or None for the items themselves
+    :return: a generator yielding a list of the items in each window, or its aggregation
+    """
+    return _windows(stream, gap=gap, size=size, aggregate=aggregate)
+
+
+def _windows(stream, size=None, duration=None, gap=None, aggregate=None):
+    timed = duration is not None or gap is not None
+    items = _IdleStream(stream) if timed else stream
+    window = None
+    count = 0
+    deadline = None
+
+    try:
+        for item in items:
+            if deadline is not None and time.time() >= deadline:
+                yield _value(window, aggregate)
+                window, count, deadline = None, 0, None
+
+            if item is not _IDLE:
+                if window is None:
+                    window = aggregate() if aggregate is not None else []
+                    if duration is not None:
+                        deadline = time.time() + duration
+                if aggregate is not None:
+                    window.add(item)
+                else:
+                    window.append(item)
+                count += 1
+                if gap is not None:
+                    deadline = time.time() + gap
+                if count == size:
+                    yield _value(window, aggregate)
+                    window, count, deadline = None, 0, None
+
+            if timed:
+                items.timeout = None if deadline is None else max(deadline - time.time(), 0)
+
+        if window is not None:
+            yield _value(window, aggregate)
+    finally:
+        if timed:
+            items.close()
+
+
+def _value(window, aggregate):
+    return window.value if aggregate is not None else window
+
+
+class _IdleStream(object):
+    """
+    Iterates over a stream, yielding _IDLE when no item arrives within timeout seconds. The stream is read by its
+    own greenlet, so that waiting for an item can time out, but only when an item is asked for: a stream that
+    answers its callers as items are taken, like the invoker's per-message input, must not be read ahead.
+    """
+
+    def __init__(self, stream):
+        self.timeout = None
+        self.requests = Queue()
+        self.items = Queue()
+        # whether the reader is fetching an item that has not been returned yet, after an idle timeout
+        self.requested = False
+        self.reader = gevent.spawn(_read, iter(stream), self.requests, self.items)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.requested:
+            self.requests.put(None)
+            self.requested = True
+        try:
+            item, err = self.items.get(timeout=self.timeout)
+        except Empty:
+            return _IDLE
+        self.requested = False
+        if err is not None:
+            raise err
+        if item is _END:
+            raise StopIteration
+        return item
+
+    def close(self):
+        self.reader.kill(block=False)
+
+
+def _read(stream, requests, items):
+    # fetch one item for each request
+    while True:
+        requests.get()
+        try:
+            item = next(stream, _END)
+        except Exception as err:
+            items.put((None, err))
+            return
+        items.put((item, None))
+        if item is _END:
+            return
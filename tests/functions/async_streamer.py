@@ -0,0 +1,9 @@
+import asyncio
+
+interaction_model = "stream"
+
+
+async def bidirectional(stream):
+    async for item in stream:
+        await asyncio.sleep(0)
+        yield item.upper()
@@ -0,0 +1,17 @@
+interaction_model = "batch"
+
+
+def upper(batch):
+    return [item.upper() for item in batch]
+
+
+def sizes(batch):
+    return ["%s:%d" % (item, len(batch)) for item in batch]
+
+
+def short(batch):
+    return batch[1:]
+
+
+def lengths(batch):
+    return [len(batch)] * len(batch)
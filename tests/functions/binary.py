@@ -0,0 +1,6 @@
+def type_name(data):
+    return type(data).__name__
+
+
+def tail(data):
+    return memoryview(data)[1:]
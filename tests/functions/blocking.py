@@ -0,0 +1,8 @@
+import threading
+import time
+
+
+def sleep(arg):
+    # time.sleep blocks the calling native thread, as a C extension releasing the GIL would
+    time.sleep(0.5)
+    return threading.current_thread().name
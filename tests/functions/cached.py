@@ -0,0 +1,12 @@
+import gevent
+
+calls = []
+
+cache = {"max_entries": 2, "ttl": 60}
+
+
+def lookup(arg):
+    calls.append(arg)
+    # slow enough for concurrent identical requests to arrive while the first is being computed
+    gevent.sleep(0.2)
+    return arg.upper()
@@ -0,0 +1,17 @@
+import asyncio
+
+
+async def upper(arg):
+    await asyncio.sleep(0.01)
+    return arg.upper()
+
+
+async def slow(arg):
+    await asyncio.sleep(0.5)
+    return arg
+
+
+async def counter():
+    for i in range(3):
+        await asyncio.sleep(0)
+        yield str(i)
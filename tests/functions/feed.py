@@ -0,0 +1,8 @@
+produced = 0
+
+
+def large():
+    global produced
+    while True:
+        produced += 1
+        yield 'x' * 65536
@@ -0,0 +1,15 @@
+import gevent
+
+concurrency = 4
+
+
+def lookup(arg):
+    # an I/O bound function, the wait overlaps with those of other invocations
+    gevent.sleep(float(arg))
+    return arg
+
+
+def failing(arg):
+    if arg == 'bad':
+        raise ValueError(arg)
+    return arg
@@ -0,0 +1,18 @@
+from invoker import windows
+
+init_calls = []
+
+
+def init():
+    init_calls.append(1)
+
+
+def upper(arg):
+    return arg.upper()
+
+
+def pairs(stream):
+    return (" ".join(window) for window in windows.tumbling(stream, 2))
+
+
+pairs.interaction_model = 'stream'
@@ -12,3 +12,10 @@ def source():
     from itertools import count
     return(str(item) for item in count())
 
+
+
+def failing(stream):
+    for item in stream:
+        if item == "bad":
+            raise ValueError(item)
+        yield item.upper()
@@ -0,0 +1,5 @@
+payload = 'items'
+
+
+def total(items):
+    return sum(item['amount'] for item in items)
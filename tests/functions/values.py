@@ -0,0 +1,21 @@
+import json
+
+
+def keys(vals):
+    return sorted(vals)
+
+
+def count(vals):
+    return len(vals)
+
+
+def serialized(vals):
+    return json.dumps(sorted(vals))
+
+
+def encoded(vals):
+    return json.dumps(len(vals)).encode()
+
+
+def echo(vals):
+    return vals
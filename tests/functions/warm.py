@@ -0,0 +1,14 @@
+initialized = False
+calls = []
+
+warmup = ["warm", "up"]
+
+
+def init():
+    global initialized
+    initialized = True
+
+
+def handle(arg):
+    calls.append(arg)
+    return arg.upper()
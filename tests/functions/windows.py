@@ -1,52 +1,33 @@
-from itertools import zip_longest, tee
 import struct
 import json
 
+from invoker import windows
+
 interaction_model = 'stream'
 
 
 def discrete_window(stream):
-    window_size=3
     """
-    Adapted from https://mail.python.org/pipermail/python-ideas/2013-December/024492.html
-    First create a list of generators of len(window_size). Each payload is an integer represented as bytes which we unmarshall.
-    The zip function merges the next element from each generator in the list into tuples. The output is a stream of tuples 
-    ((0,1,2),(3,4,5),(6,7,8),...) . Each tuple is serialized as json.    
+    Each payload is an integer represented as bytes which we unmarshall. The output is a stream of windows
+    [0,1,2],[3,4,5],[6,7,8],... Each window is serialized as json.
     """
-
-    repeated_iterable = [(struct.unpack(">I",i)[0] for i in stream)] * window_size
-    return (json.dumps(tpl) for tpl in zip_longest(*repeated_iterable, fillvalue=None))
+    return (json.dumps(window) for window in windows.tumbling((struct.unpack(">I", i)[0] for i in stream), 3))
 
 
 def discrete_window_text(stream):
-    window_size=3
-    repeated_iterable = [stream] * window_size
-    return (json.dumps(tpl) for tpl in zip_longest(*repeated_iterable, fillvalue=None))
+    return (json.dumps(window) for window in windows.tumbling(stream, 3))
 
 
 def sliding_window(stream):
-    window_size=3
     """
-    Adapted from https://stackoverflow.com/questions/6822725/rolling-or-sliding-window-iterator
-    The zip function merges the next element from each generator in the list into tuples. The output is a stream of tuples.
-    Each tuple is serialized as json
+    The output is a stream of windows [0,1,2],[1,2,3],[2,3,4],... Each window is serialized as json
     """
+    return (json.dumps(list(window)) for window in windows.sliding((struct.unpack(">I", i)[0] for i in stream), 3))
+
+
+def session_window(stream):
+    return (json.dumps(window) for window in windows.session(stream, 5, size=2))
+
 
-    iters = tee((struct.unpack(">I",i)[0] for i in stream), window_size)
-    '''
-    iters = (count(),count(),count())
-    '''
-
-    '''
-    consume first i elements 
-    '''
-    for i in range(1, window_size):
-        for each in iters[i:]:
-            next(each)
-
-    '''
-    (0,1,2,3,4,5,...)
-    (1,2,3,4,5,...)
-    (2,3,4,5,...)
-    '''
-    return (json.dumps(tpl) for tpl in zip(*iters))
+def timed_window(stream):
+    return (json.dumps(window) for window in windows.timed(stream, 5, size=2))
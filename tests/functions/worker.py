@@ -0,0 +1,5 @@
+import os
+
+
+def pid(arg):
+    return str(os.getpid())
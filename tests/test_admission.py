@@ -0,0 +1,59 @@
+import unittest
+
+from invoker.admission import AdmissionController
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def test_unlimited(self):
+        admission = AdmissionController()
+
+        self.assertTrue(all(admission.acquire() for _ in range(1000)))
+
+    def test_limit(self):
+        admission = AdmissionController(limit=2)
+
+        self.assertTrue(admission.acquire())
+        self.assertTrue(admission.acquire())
+        self.assertFalse(admission.acquire())
+        admission.release(0.01)
+        self.assertTrue(admission.acquire())
+
+    def test_from_env(self):
+        admission = AdmissionController.from_env({'MAX_CONCURRENCY': '8', 'QUEUE_WAIT_MS': '250', 'RETRY_AFTER': '3'})
+
+        self.assertEqual(8, admission.limit)
+        self.assertEqual(0.25, admission.queue_wait)
+        self.assertEqual(3, admission.retry_after)
+        self.assertFalse(admission.adaptive)
+
+    def test_fails_fast_by_default(self):
+        admission = AdmissionController.from_env({})
+
+        self.assertEqual(0, admission.limit)
+        self.assertEqual(0.1, admission.queue_wait)
+
+    def test_adaptive_grows_while_latency_is_flat(self):
+        admission = AdmissionController(limit=10, adaptive=True)
+
+        for _ in range(50):
+            admission.acquire()
+            admission.release(0.01)
+
+        self.assertGreater(admission.limit, 10)
+
+    def test_adaptive_shrinks_as_latency_rises(self):
+        admission = AdmissionController(limit=100, adaptive=True)
+        admission.acquire()
+        admission.release(0.01)
+
+        for _ in range(50):
+            admission.acquire()
+            admission.release(0.1)
+
+        self.assertLess(admission.limit, 100)
+        self.assertGreaterEqual(admission.limit, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
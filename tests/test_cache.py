@@ -0,0 +1,102 @@
+import unittest
+
+import gevent
+
+from invoker import cache
+from invoker.cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        responses = ResponseCache()
+        computed = []
+
+        def compute():
+            computed.append(1)
+            return 'response'
+
+        self.assertEqual(('response', 'miss'), responses.get_or_compute('key', compute))
+        self.assertEqual(('response', 'hit'), responses.get_or_compute('key', compute))
+        self.assertEqual(1, len(computed))
+
+    def test_evicts_least_recently_used(self):
+        responses = ResponseCache(max_entries=2)
+        responses.put('a', 1)
+        responses.put('b', 2)
+        responses.get('a')
+        responses.put('c', 3)
+
+        self.assertEqual(1, responses.get('a'))
+        self.assertIsNone(responses.get('b'))
+        self.assertEqual(3, responses.get('c'))
+        self.assertEqual(2, len(responses))
+
+    def test_ttl(self):
+        responses = ResponseCache(ttl=0.05)
+        responses.put('a', 1)
+        self.assertEqual(1, responses.get('a'))
+
+        gevent.sleep(0.1)
+        self.assertIsNone(responses.get('a'))
+        self.assertEqual(0, len(responses))
+
+    def test_coalesces_concurrent_computations(self):
+        responses = ResponseCache()
+        computed = []
+
+        def compute():
+            computed.append(1)
+            gevent.sleep(0.05)
+            return 'response'
+
+        greenlets = [gevent.spawn(responses.get_or_compute, 'key', compute) for _ in range(5)]
+        gevent.joinall(greenlets)
+
+        self.assertEqual(1, len(computed))
+        self.assertEqual(['miss', 'coalesced', 'coalesced', 'coalesced', 'coalesced'],
+                         [greenlet.value[1] for greenlet in greenlets])
+
+    def test_uncacheable_responses_are_shared_but_not_kept(self):
+        responses = ResponseCache()
+
+        def compute():
+            gevent.sleep(0.05)
+            return 'error'
+
+        greenlets = [gevent.spawn(responses.get_or_compute, 'key', compute, lambda value: False) for _ in range(2)]
+        gevent.joinall(greenlets)
+
+        self.assertEqual(['error', 'error'], [greenlet.value[0] for greenlet in greenlets])
+        self.assertIsNone(responses.get('key'))
+
+    def test_errors_reach_waiting_requests(self):
+        responses = ResponseCache()
+
+        def compute():
+            gevent.sleep(0.05)
+            raise RuntimeError('failed')
+
+        greenlets = [gevent.spawn(responses.get_or_compute, 'key', compute) for _ in range(2)]
+        gevent.joinall(greenlets)
+
+        self.assertTrue(all(isinstance(greenlet.exception, RuntimeError) for greenlet in greenlets))
+        self.assertEqual({}, responses.in_flight)
+
+    def test_from_config(self):
+        self.assertIsNone(ResponseCache.from_config(None))
+        self.assertEqual(1024, ResponseCache.from_config(True).max_entries)
+
+        responses = ResponseCache.from_config({'max_entries': 10, 'ttl': 5})
+        self.assertEqual(10, responses.max_entries)
+        self.assertEqual(5, responses.ttl)
+
+    def test_key(self):
+        self.assertEqual(cache.key(b'body', 'text/plain', 'text/plain'), cache.key(b'body', 'text/plain', 'text/plain'))
+        self.assertNotEqual(cache.key(b'body', 'text/plain', 'text/plain'),
+                            cache.key(b'body', 'text/plain', 'application/json'))
+        self.assertNotEqual(cache.key(b'body', 'text/plain', 'text/plain'), cache.key(b'other', 'text/plain', 'text/plain'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import array
+import unittest
+from unittest import mock
+
+from invoker import codec
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_lookup(self):
+        self.assertIs(codec.JSON, codec.lookup('application/json; charset=UTF-8'))
+        self.assertIs(codec.JSON, codec.lookup('application/vnd.riff+json'))
+        self.assertIs(codec.TEXT, codec.lookup('text/plain'))
+        self.assertIs(codec.TEXT, codec.lookup('application/x-www-form-urlencoded'))
+        self.assertIs(codec.MSGPACK, codec.lookup('application/msgpack'))
+        self.assertIs(codec.BYTES, codec.lookup('image/png'))
+
+    def test_register(self):
+        class Reversed(codec.Codec):
+            def decode(self, data, contenttype):
+                return data[::-1]
+
+            def encode(self, value, contenttype):
+                return value[::-1]
+
+        codec.register('application/x-reversed', Reversed())
+        try:
+            self.assertEqual(b'cba', codec.lookup('application/x-reversed').decode(b'abc', 'application/x-reversed'))
+        finally:
+            del codec.REGISTRY['application/x-reversed']
+
+    def test_json_encode(self):
+        self.assertEqual(b'[1, 2]', codec.JSON.encode((1, 2), 'application/json'))
+        self.assertEqual(b'42', codec.JSON.encode(42, 'application/json'))
+        self.assertEqual(b'{"a": 1}', codec.JSON.encode('{"a": 1}', 'application/json'))
+
+    def test_text_charset(self):
+        self.assertEqual('caf\xe9', codec.TEXT.decode('caf\xe9'.encode('latin-1'), 'text/plain; charset=latin-1'))
+        self.assertEqual(b'caf\xc3\xa9', codec.TEXT.encode('caf\xe9', 'text/plain'))
+
+    def test_text_encode_structured(self):
+        self.assertEqual(b'{"a": [1, 2]}', codec.TEXT.encode({'a': [1, 2]}, 'text/plain'))
+        self.assertEqual(b'[1, 2]', codec.BYTES.encode((1, 2), 'application/octet-stream'))
+        self.assertEqual(b'42', codec.TEXT.encode(42, 'text/plain'))
+
+    def test_encode_memoryview(self):
+        values = memoryview(array.array('i', [1, 2, 3]))
+        for payload_codec in (codec.BYTES, codec.TEXT, codec.JSON):
+            data = payload_codec.encode(values, 'application/octet-stream')
+            self.assertEqual(values.nbytes, len(data))
+            self.assertEqual(values.tobytes(), bytes(data))
+        self.assertEqual(b'\x00\x02', bytes(codec.BYTES.encode(memoryview(b'\x00\x01\x02\x03')[::2], '')))
+        with mock.patch.object(codec, 'msgpack', None):
+            self.assertEqual(values.tobytes(), codec.MSGPACK.decode(bytes(codec.MSGPACK.encode(values, '')), ''))
+
+    def test_msgpack_roundtrip(self):
+        values = [None, True, False, 0, 127, 128, 65536, 2 ** 40, -1, -33, -129, -2 ** 40, 1.5, '', 'x' * 40,
+                  'x' * 300, b'\x00\xff', list(range(20)), {'a': [1, {'b': None}]}, {str(i): i for i in range(20)}]
+        with mock.patch.object(codec, 'msgpack', None):
+            for value in values:
+                data = codec.MSGPACK.encode(value, 'application/msgpack')
+                self.assertEqual(value, codec.MSGPACK.decode(bytes(data), 'application/msgpack'))
+
+    def test_msgpack_format(self):
+        with mock.patch.object(codec, 'msgpack', None):
+            self.assertEqual(b'\x82\xa1a\x01\xa1b\x92\xc3\xc0',
+                             bytes(codec.MSGPACK.encode({'a': 1, 'b': [True, None]}, 'application/msgpack')))
+
+    def test_negotiate(self):
+        self.assertEqual('text/plain', codec.negotiate(None, 'text/plain'))
+        self.assertEqual('text/plain', codec.negotiate('*/*', 'text/plain'))
+        self.assertEqual('application/json', codec.negotiate('application/json', 'text/plain'))
+        self.assertEqual('application/msgpack',
+                         codec.negotiate('application/json, application/msgpack', 'application/json'))
+        self.assertEqual('application/json',
+                         codec.negotiate('application/json, application/msgpack;q=0.5', 'application/json'))
+        self.assertEqual('text/plain', codec.negotiate('image/png', 'text/plain'))
+        self.assertEqual('text/plain', codec.negotiate('text/plain', 'application/json'))
+        self.assertEqual('text/csv', codec.negotiate('image/png, text/csv;q=0.5', 'application/json'))
+        self.assertEqual('application/problem+json', codec.negotiate('application/problem+json', 'text/plain'))
+        self.assertEqual('application/octet-stream', codec.negotiate('application/octet-stream', 'text/plain'))
+        self.assertEqual('application/json', codec.negotiate('text/*', 'application/json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
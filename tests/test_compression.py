@@ -0,0 +1,107 @@
+import gzip
+import io
+import zlib
+import unittest
+
+from invoker import compression
+from invoker.compression import Compressor
+
+
+class NegotiateTest(unittest.TestCase):
+
+    def test_negotiate(self):
+        self.assertEqual('gzip', compression.negotiate('gzip, deflate, br'))
+        self.assertEqual('deflate', compression.negotiate('deflate'))
+        self.assertEqual('deflate', compression.negotiate('gzip;q=0.5, deflate'))
+        self.assertEqual('gzip', compression.negotiate('*'))
+        self.assertEqual('deflate', compression.negotiate('*, gzip;q=0'))
+        self.assertIsNone(compression.negotiate('identity'))
+        self.assertIsNone(compression.negotiate('br'))
+        self.assertIsNone(compression.negotiate(None))
+
+
+class DecompressTest(unittest.TestCase):
+
+    def test_gzip(self):
+        body = b''.join(b'line %d\n' % n for n in range(10000))
+        reader = compression.decompress(io.BytesIO(gzip.compress(body)), 'gzip')
+
+        self.assertEqual(body, reader.read())
+        self.assertEqual(b'', reader.read())
+
+    def test_deflate(self):
+        body = b'hello world' * 100
+
+        self.assertEqual(body, compression.decompress(io.BytesIO(zlib.compress(body)), 'deflate').read())
+        raw = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = raw.compress(body) + raw.flush()
+        self.assertEqual(body, compression.decompress(io.BytesIO(data), 'deflate').read())
+
+    def test_read_sizes(self):
+        body = bytes(range(256)) * 1000
+        reader = compression.decompress(io.BytesIO(gzip.compress(body)), 'gzip')
+
+        chunks = list(iter(lambda: reader.read(1000), b''))
+        self.assertTrue(all(len(chunk) == 1000 for chunk in chunks[:-1]))
+        self.assertEqual(body, b''.join(chunks))
+
+    def test_readline(self):
+        body = b'{"n": 1}\n{"n": 2}\n\nlast'
+        reader = compression.decompress(io.BytesIO(gzip.compress(body)), 'gzip')
+
+        self.assertEqual([b'{"n": 1}\n', b'{"n": 2}\n', b'\n', b'last'], list(reader))
+
+    def test_bounded_output(self):
+        # a highly compressible body is decompressed a chunk at a time, not all at once
+        reader = compression.decompress(io.BytesIO(gzip.compress(b'\0' * (1 << 24))), 'gzip')
+
+        self.assertEqual(10, len(reader.read(10)))
+        self.assertLessEqual(len(reader.buffer), compression.CHUNK_SIZE)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            compression.decompress(io.BytesIO(b'not gzip at all'), 'gzip').read()
+        with self.assertRaises(ValueError):
+            compression.decompress(io.BytesIO(gzip.compress(b'hello world')[:-6]), 'gzip').read()
+        with self.assertRaises(ValueError):
+            compression.decompress(io.BytesIO(b''), 'br')
+
+
+class CompressorTest(unittest.TestCase):
+
+    def test_compress(self):
+        compressor = Compressor(min_size=100)
+        body = [b'a' * 100, b'b' * 100]
+
+        self.assertEqual(b''.join(body), gzip.decompress(compressor.compress(body, 'gzip')[0]))
+        self.assertEqual(b''.join(body), zlib.decompress(compressor.compress(body, 'deflate')[0]))
+        self.assertIsNone(compressor.compress([b'small'], 'gzip'))
+
+    def test_offload(self):
+        compressor = Compressor(min_size=0, offload_size=10)
+        body = [b'x' * 1000]
+
+        self.assertEqual(body[0], gzip.decompress(compressor.compress(body, 'gzip')[0]))
+
+    def test_compress_stream(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        frames = Compressor().compress_stream(iter([b'one\n', b'two\n']), 'gzip')
+
+        # each frame can be decompressed as soon as it arrives
+        self.assertEqual(b'one\n', decompressor.decompress(next(frames)))
+        self.assertEqual(b'two\n', decompressor.decompress(next(frames)))
+        self.assertEqual(b'', decompressor.decompress(b''.join(frames)))
+        self.assertTrue(decompressor.eof)
+
+    def test_from_env(self):
+        self.assertIsNone(Compressor.from_env({'COMPRESSION': 'false'}))
+        compressor = Compressor.from_env({'COMPRESSION_LEVEL': '1', 'COMPRESSION_OFFLOAD_SIZE': '0'})
+        self.assertEqual(1, compressor.level)
+        self.assertEqual(1024, compressor.min_size)
+        self.assertIsNone(compressor.offload_size)
+        with self.assertRaises(ValueError):
+            Compressor(level=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import io
+import struct
+import unittest
+
+from invoker import framing
+
+
+class FramingTest(unittest.TestCase):
+
+    def test_ndjson(self):
+        body = io.BytesIO(b'{"a": 1}\n\n[1, 2]\n"x"\n')
+
+        self.assertEqual([{'a': 1}, [1, 2], 'x'], list(framing.read_frames(body, framing.NDJSON)))
+        self.assertEqual(b'[1, 2]\n', framing.write_frame([1, 2], framing.NDJSON))
+
+    def test_length_prefixed(self):
+        contenttype = framing.LENGTH_PREFIXED + '; type=text/plain'
+        body = io.BytesIO(framing.write_frame('hello', contenttype) + framing.write_frame('', contenttype))
+
+        self.assertEqual(b'\x00\x00\x00\x05hello', framing.write_frame('hello', contenttype))
+        self.assertEqual(['hello', ''], list(framing.read_frames(body, contenttype)))
+
+    def test_length_prefixed_binary(self):
+        body = io.BytesIO(b''.join(framing.write_frame(struct.pack('>I', i), framing.LENGTH_PREFIXED)
+                                   for i in range(3)))
+
+        self.assertEqual([struct.pack('>I', i) for i in range(3)],
+                         list(framing.read_frames(body, framing.LENGTH_PREFIXED)))
+
+    def test_truncated_frame(self):
+        body = io.BytesIO(b'\x00\x00\x00\x05hel')
+
+        with self.assertRaises(ValueError):
+            list(framing.read_frames(body, framing.LENGTH_PREFIXED))
+
+    def test_event_stream(self):
+        self.assertEqual(b'data: {"a": 1}\n\n', framing.write_frame({'a': 1}, framing.EVENT_STREAM))
+        self.assertEqual(b'data: one\ndata: two\n\n', framing.write_frame('one\ntwo', framing.EVENT_STREAM))
+
+    def test_negotiate(self):
+        self.assertEqual(framing.EVENT_STREAM, framing.negotiate('text/html, text/event-stream'))
+        self.assertIsNone(framing.negotiate('application/json'))
+        self.assertIsNone(framing.negotiate(None))
+
+    def test_is_framed(self):
+        self.assertTrue(framing.is_framed('application/x-ndjson'))
+        self.assertTrue(framing.is_framed('application/x-length-prefixed; type=text/plain'))
+        self.assertFalse(framing.is_framed('application/json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,8 +22,8 @@ if sys.version_info[0] != 3:
 
 import unittest
 import os
+import tempfile
 
-sys.path.append('invoker')
 sys.path.append('tests/functions')
 
 import invoker.function_invoker
@@ -175,18 +175,185 @@ class FunctionInvokerTest(unittest.TestCase):
         for i in range(10):
             self.assertEqual(str(i), next(responses))
 
-    def test_zip(self):
-        env = {
-            'FUNCTION_URI': 'file://%s/tests/zip/myfunc.zip?handler=func.handler' % os.getcwd()
-        }
+    def test_batch(self):
+        env = function_env('batch.py', 'sizes')
+        env['BATCH_SIZE'] = '3'
+        function_invoker = invoker.function_invoker.install_function(env)
+
+        responses = function_invoker.invoke(iter(["a", "b", "c", "d", "e", "f", "g"]))
+
+        self.assertEqual(["a:3", "b:3", "c:3", "d:3", "e:3", "f:3", "g:1"], list(responses))
+
+    def test_batch_result_mismatch(self):
+        env = function_env('batch.py', 'short')
+        function_invoker = invoker.function_invoker.install_function(env)
+
+        with self.assertRaises(ValueError):
+            list(function_invoker.invoke(iter(["a", "b"])))
+
+    def test_coroutine(self):
+        env = function_env('coroutines.py', 'upper')
+        function_invoker = invoker.function_invoker.install_function(env)
+        self.assertTrue(function_invoker.is_coroutine)
+
+        responses = function_invoker.invoke(iter(["hello", "world"]))
+
+        self.assertEqual(["HELLO", "WORLD"], list(responses))
+
+    def test_async_generator_stream(self):
+        env = function_env('async_streamer.py', 'bidirectional')
+        function_invoker = invoker.function_invoker.install_function(env)
+        self.assertTrue(function_invoker.is_async_generator)
+
+        responses = function_invoker.invoke(iter(["foo", "bar"]))
+
+        self.assertEqual(["FOO", "BAR"], list(responses))
+
+    def test_async_generator_source(self):
+        env = function_env('coroutines.py', 'counter')
+        function_invoker = invoker.function_invoker.install_function(env)
+
+        responses = function_invoker.invoke(None)
+
+        self.assertEqual(["0", "1", "2"], list(responses))
+
+    def test_threadpool_executor(self):
+        import threading
+
+        env = function_env('blocking.py', 'sleep')
+        env['EXECUTOR'] = 'threadpool'
+        function_invoker = invoker.function_invoker.install_function(env)
+
+        responses = list(function_invoker.invoke(iter(["hello"])))
+
+        self.assertNotEqual(threading.current_thread().name, responses[0])
+
+    def test_concurrency_keeps_order(self):
+        import time
+        function_invoker = invoker.function_invoker.install_function(function_env('lookups.py', 'lookup'))
+        self.assertEqual(4, function_invoker.concurrency)
+
+        start = time.time()
+        responses = list(function_invoker.invoke(iter(['0.2', '0.1', '0.05', '0.15'])))
+
+        self.assertLess(time.time() - start, 0.35)
+        self.assertEqual(['0.2', '0.1', '0.05', '0.15'], responses)
+
+    def test_concurrency_unordered(self):
+        env = function_env('lookups.py', 'lookup')
+        env['CONCURRENCY'] = '8'
+        function_invoker = invoker.function_invoker.install_function(env)
+        function_invoker.ordered = False
+
+        responses = list(function_invoker.invoke(iter(['0.2', '0.1', '0.05', '0.15'])))
+
+        self.assertEqual(8, function_invoker.concurrency)
+        self.assertEqual(['0.05', '0.1', '0.15', '0.2'], responses)
+
+    def test_concurrency_error(self):
+        function_invoker = invoker.function_invoker.install_function(function_env('lookups.py', 'failing'))
+
+        responses = function_invoker.invoke(iter(['good', 'bad', 'good']))
+
+        self.assertEqual('good', next(responses))
+        with self.assertRaises(ValueError):
+            next(responses)
+
+    def test_invoke_each(self):
+        function_invoker = invoker.function_invoker.install_function(function_env('lookups.py', 'failing'))
+        function_invoker.ordered = False
+
+        pairs = list(function_invoker.invoke_each(iter(['good', 'bad', 'also good'])))
+
+        self.assertEqual([(None, 'good'), (None, 'also good')], [pairs[0], pairs[2]])
+        self.assertIsInstance(pairs[1][0], ValueError)
+
+    def test_invoke_each_reader_error(self):
+        function_invoker = invoker.function_invoker.install_function(function_env('lookups.py', 'failing'))
+
+        def arguments():
+            yield 'good'
+            raise ValueError('unreadable')
+
+        pairs = function_invoker.invoke_each(arguments())
+
+        self.assertEqual((None, 'good'), next(pairs))
+        with self.assertRaises(ValueError):
+            next(pairs)
+
+    def test_invoke_each_batch(self):
+        env = function_env('batch.py', 'short')
+        env['BATCH_SIZE'] = '2'
         function_invoker = invoker.function_invoker.install_function(env)
 
-        generator = (message for message in ["hello"])
+        pairs = list(function_invoker.invoke_each(iter(['a', 'b', 'c'])))
+
+        self.assertEqual(3, len(pairs))
+        self.assertTrue(all(isinstance(err, ValueError) for err, _ in pairs))
+
+    def test_install_routes(self):
+        import mixed
+        functions = '%s/tests/functions' % os.getcwd()
+        env = {'FUNCTION_ROUTES': '/upper=file://%s/mixed.py?handler=upper,/pairs=file://%s/mixed.py?handler=pairs'
+                                  % (functions, functions)}
+        del mixed.init_calls[:]
+
+        routes = invoker.function_invoker.install_routes(env)
+
+        self.assertEqual(['/pairs', '/upper'], sorted(routes))
+        self.assertEqual(None, routes['/upper'].interaction_model)
+        self.assertEqual('stream', routes['/pairs'].interaction_model)
+        self.assertEqual([1], mixed.init_calls)
+        self.assertEqual(['a b', 'c'], list(routes['/pairs'].invoke(iter('abc'))))
+
+    def test_init_and_warm_up(self):
+        import warm
+
+        function_invoker = invoker.function_invoker.install_function(function_env('warm.py', 'handle'))
+        self.assertTrue(warm.initialized)
+        self.assertEqual([], warm.calls)
+
+        function_invoker.warm_up()
+        self.assertEqual(["warm", "up"], warm.calls)
+
+    def test_zip(self):
+        with tempfile.TemporaryDirectory() as cache:
+            env = zip_env(ARCHIVE_CACHE=cache)
+            function_invoker = invoker.function_invoker.install_function(env)
+
+            generator = (message for message in ["hello"])
+
+            self.assertEqual('HELLO', next(function_invoker.invoke(generator)))
+            self.assertEqual('handler', function_invoker.name)
+            self.assertFalse(os.path.exists('func.py'))
+
+            extracted = os.listdir(cache)
+            self.assertEqual(1, len(extracted))
+            self.assertTrue(os.path.isdir(os.path.join(cache, extracted[0], '__pycache__')))
+            self.assertTrue(sys.modules['func'].__file__.startswith(os.path.join(cache, extracted[0])))
+
+            unload_zip()
+            invoker.function_invoker.install_function(env)
+            self.assertEqual(extracted, os.listdir(cache))
+        unload_zip()
+
+    def test_zipimport(self):
+        function_invoker = invoker.function_invoker.install_function(zip_env(ZIP_IMPORT='true'))
+
+        self.assertEqual('HELLO', next(function_invoker.invoke(iter(["hello"]))))
+        self.assertTrue('myfunc.zip' in sys.modules['func'].__file__)
+        unload_zip()
+
+
+def zip_env(**env):
+    env['FUNCTION_URI'] = 'file://%s/tests/zip/myfunc.zip?handler=func.handler' % os.getcwd()
+    return env
+
 
-        self.assertEqual('HELLO', next(function_invoker.invoke(generator)))
-        os.remove('func.py')
-        os.remove('helpers.py')
-        self.assertEqual('handler', function_invoker.name)
+def unload_zip():
+    sys.path.pop(0)
+    for module in ('func', 'helpers'):
+        sys.modules.pop(module, None)
 
 
 def function_env(module, handler):
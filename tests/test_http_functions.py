@@ -1,4 +1,8 @@
+import gzip
+import io
+import json
 import sys
+from unittest import mock
 from urllib.error import HTTPError
 from tests.utils import testutils
 from threading import Thread
@@ -6,13 +10,21 @@ from threading import Thread
 import unittest
 import os
 import urllib.request
+import http.client
+import socket
 import time
+import signal
+import struct
+import subprocess
 
-PYTHONPATH = ['invoker', '%s/tests/functions' % os.getcwd(), '%s/invoker' % os.getcwd()]
+PYTHONPATH = ['%s/tests/functions' % os.getcwd()]
 for p in PYTHONPATH:
     sys.path.append(p)
 
+from invoker import codec
+from invoker import framing
 from invoker import function_invoker
+from invoker import http_server
 
 
 # PYTHON = sys.executable
@@ -88,6 +100,479 @@ class HttpFunctionTest(unittest.TestCase):
             if len(r):
                 self.assertTrue(r in expected)
 
+    def test_session_window(self):
+        run_function(port=self.port, module="windows.py", handler="session_window")
+
+        # each message is answered once the function asks for the next, not read ahead of the window
+        responses = call_multiple_http_messages(self.port, ("%d" % i for i in range(4)))
+        self.assertEqual([b'', b'["0", "1"]', b'', b'["2", "3"]'], [response.read() for response in responses])
+
+    def test_timed_window(self):
+        run_function(port=self.port, module="windows.py", handler="timed_window")
+
+        responses = call_multiple_http_messages(self.port, ("%d" % i for i in range(4)))
+        self.assertEqual([b'', b'["0", "1"]', b'', b'["2", "3"]'], [response.read() for response in responses])
+
+    def test_concurrent_requests(self):
+        run_function(port=self.port, module="upper.py", handler="handle")
+
+        messages = ["message-%d" % i for i in range(100)]
+        responses = {}
+
+        def call(message):
+            responses[message] = call_http(self.port, message, {}).read()
+
+        threads = [Thread(target=call, args=(message,)) for message in messages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for message in messages:
+            self.assertEqual(message.upper().encode(), responses[message])
+
+    def test_filter_stream(self):
+        run_function(port=self.port, module="streamer.py", handler="filter")
+
+        responses = call_multiple_http_messages(self.port, ["foo", "bar", "foobar"])
+
+        self.assertEqual([b'foo', b'', b'foobar'], [response.read() for response in responses])
+
+    def test_batch(self):
+        run_function(port=self.port, module="batch.py", handler="sizes", BATCH_SIZE='8', BATCH_WAIT_MS='50')
+
+        messages = ["message-%d" % i for i in range(20)]
+        responses = {}
+
+        def call(message):
+            responses[message] = call_http(self.port, message, {}).read().decode()
+
+        threads = [Thread(target=call, args=(message,)) for message in messages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        sizes = []
+        for message in messages:
+            item, size = responses[message].rsplit(':', 1)
+            self.assertEqual(message, item)
+            sizes.append(int(size))
+        self.assertTrue(max(sizes) > 1)
+        self.assertTrue(max(sizes) <= 8)
+
+    def test_coroutine_requests_overlap(self):
+        run_function(port=self.port, module="coroutines.py", handler="slow")
+
+        messages = ["message-%d" % i for i in range(20)]
+        responses = {}
+
+        def call(message):
+            responses[message] = call_http(self.port, message, {}).read()
+
+        start = time.time()
+        threads = [Thread(target=call, args=(message,)) for message in messages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLess(time.time() - start, 5)
+        for message in messages:
+            self.assertEqual(message.encode(), responses[message])
+
+    def test_async_generator_stream(self):
+        run_function(port=self.port, module="async_streamer.py", handler="bidirectional")
+
+        responses = call_multiple_http_messages(self.port, ["hello", "world"])
+
+        self.assertEqual([b'HELLO', b'WORLD'], [response.read() for response in responses])
+
+    def test_concurrency_avoids_head_of_line_blocking(self):
+        run_function(port=self.port, module="lookups.py", handler="lookup")
+
+        slow = Thread(target=lambda: call_http(self.port, "1", {'Content-Type': 'text/plain'}).read())
+        slow.start()
+        time.sleep(0.1)
+
+        start = time.time()
+        self.assertEqual(b'0.01', call_http(self.port, "0.01", {'Content-Type': 'text/plain'}).read())
+        self.assertLess(time.time() - start, 0.5)
+        slow.join()
+
+    def test_threadpool_executor(self):
+        run_function(port=self.port, module="blocking.py", handler="sleep", EXECUTOR='threadpool', POOL_SIZE='10')
+
+        responses = []
+
+        def call(message):
+            responses.append(call_http(self.port, message, {}).read())
+
+        start = time.time()
+        threads = [Thread(target=call, args=("message-%d" % i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLess(time.time() - start, 2.5)
+        self.assertEqual(10, len(responses))
+        self.assertTrue(len(set(responses)) > 1)
+
+    def test_binary_window(self):
+        run_function(port=self.port, module="windows.py", handler="discrete_window")
+
+        headers = {'Content-Type': 'application/octet-stream'}
+        responses = call_multiple_http_messages(self.port, (struct.pack(">I", i) for i in range(6)), headers)
+
+        self.assertEqual([b'', b'', b'[0, 1, 2]', b'', b'', b'[3, 4, 5]'], [response.read() for response in responses])
+
+    def test_binary_payload(self):
+        run_function(port=self.port, module="binary.py", handler="type_name")
+
+        response = call_http(self.port, b'\xff\x00', {'Content-Type': 'application/octet-stream'})
+
+        self.assertEqual(b'bytes', response.read())
+
+    def test_binary_result(self):
+        run_function(port=self.port, module="binary.py", handler="tail")
+
+        response = call_http(self.port, b'\xff\x00\x01', {'Content-Type': 'application/octet-stream'})
+
+        self.assertEqual(b'\x00\x01', response.read())
+        self.assertEqual('application/octet-stream', response.getheader('Content-Type'))
+
+    def test_text_charset(self):
+        run_function(port=self.port, module="upper.py", handler="handle")
+
+        response = call_http(self.port, 'caf\xe9'.encode('latin-1'), {'Content-Type': 'text/plain; charset=latin-1'})
+
+        self.assertEqual('CAF\xc9'.encode('latin-1'), response.read())
+
+    def test_ndjson_stream(self):
+        run_function(port=self.port, module="windows.py", handler="discrete_window_text")
+
+        body = ('"%d"\n' % i for i in range(9))
+        response = call_chunked_http(self.port, body, {'Content-Type': framing.NDJSON})
+
+        self.assertEqual(framing.NDJSON, response.getheader('Content-Type'))
+        self.assertEqual(b'["0", "1", "2"]\n["3", "4", "5"]\n["6", "7", "8"]\n', response.read())
+
+    def test_length_prefixed_stream(self):
+        run_function(port=self.port, module="windows.py", handler="sliding_window")
+
+        body = (framing.write_frame(struct.pack(">I", i), framing.LENGTH_PREFIXED) for i in range(5))
+        response = call_chunked_http(self.port, body, {'Content-Type': framing.LENGTH_PREFIXED})
+
+        frames = list(framing.read_frames(response, framing.LENGTH_PREFIXED))
+        self.assertEqual([b'[0, 1, 2]', b'[1, 2, 3]', b'[2, 3, 4]'], frames)
+
+    def test_stream_results_while_input_arrives(self):
+        run_function(port=self.port, module="streamer.py", handler="bidirectional")
+
+        def chunk(data):
+            return b'%x\r\n%s\r\n' % (len(data), data)
+
+        with socket.create_connection(('localhost', self.port)) as sock:
+            sock.sendall(b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/x-ndjson\r\n'
+                         b'Transfer-Encoding: chunked\r\n\r\n' + chunk(b'"hello"\n'))
+            received = b''
+            while b'HELLO' not in received:
+                data = sock.recv(1024)
+                self.assertTrue(data)
+                received += data
+
+            sock.sendall(chunk(b'"world"\n') + b'0\r\n\r\n')
+            while b'WORLD' not in received:
+                data = sock.recv(1024)
+                self.assertTrue(data)
+                received += data
+
+    def test_source_ndjson(self):
+        run_function(port=self.port, module="streamer.py", handler="source")
+
+        response = call_get(self.port, '/?limit=5', {'Accept': framing.NDJSON})
+
+        self.assertEqual(framing.NDJSON, response.getheader('Content-Type'))
+        self.assertEqual(b'0\n1\n2\n3\n4\n', response.read())
+
+    def test_source_event_stream(self):
+        run_function(port=self.port, module="streamer.py", handler="source")
+
+        response = call_get(self.port, '/?limit=2', {'Accept': 'text/event-stream'})
+
+        self.assertEqual('no-cache', response.getheader('Cache-Control'))
+        self.assertEqual(b'data: 0\n\ndata: 1\n\n', response.read())
+
+    def test_source_backpressure(self):
+        import feed
+        run_function(port=self.port, module="feed.py", handler="large")
+
+        with socket.create_connection(('localhost', self.port)) as sock:
+            sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\nAccept: application/x-ndjson\r\n\r\n')
+            self.assertTrue(sock.recv(1024))
+            time.sleep(1)
+            # only as much as fits in the socket buffers has been produced
+            self.assertLess(feed.produced, 1000)
+
+    def test_metrics(self):
+        run_function(port=self.port, module="upper.py", handler="handle")
+
+        call_multiple_http_messages(self.port, ["hello", "world"], {'Content-Type': 'text/plain'})
+        response = call_get(self.port, '/metrics', {})
+
+        self.assertTrue(response.getheader('Content-Type').startswith('text/plain; version=0.0.4'))
+        body = response.read().decode()
+        self.assertRegex(body, 'invoker_requests_total{content_type="text/plain",status="200"} [1-9]')
+        self.assertRegex(body, 'invoker_invocation_duration_seconds_count [1-9]')
+        self.assertRegex(body, 'invoker_queue_depth 0')
+        self.assertRegex(body, 'invoker_queue_capacity 50')
+        self.assertRegex(body, 'invoker_requests_in_flight 1')
+
+    def test_profile(self):
+        run_function(port=self.port, module="upper.py", handler="handle", PROFILING='true')
+
+        def load():
+            for _ in range(20):
+                call_http(self.port, "hello", {'Content-Type': 'text/plain'}).read()
+
+        thread = Thread(target=load)
+        thread.start()
+        response = call_get(self.port, '/debug/profile?seconds=0.5&interval_ms=1', {})
+        thread.join()
+
+        self.assertEqual(200, response.status)
+        lines = response.read().decode().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('gevent.hub.Hub.run' in line for line in lines))
+
+        for query in ('seconds=0', 'seconds=-1', 'interval_ms=-5', 'seconds=soon'):
+            self.assertEqual(400, call_get(self.port, '/debug/profile?' + query, {}).status, query)
+
+    def test_server_timing(self):
+        run_function(port=self.port, module="upper.py", handler="handle", SERVER_TIMING='true')
+
+        response = call_http(self.port, "hello", {'Content-Type': 'text/plain'})
+
+        self.assertEqual(b'HELLO', response.read())
+        stages = [entry.split(';')[0] for entry in response.getheader('Server-Timing').split(', ')]
+        self.assertEqual(['read', 'decode', 'queue', 'invoke', 'encode', 'total'], stages)
+
+    def test_slow_request_log(self):
+        run_function(port=self.port, module="coroutines.py", handler="slow", SLOW_REQUEST_MS='100')
+
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            call_http(self.port, "hello", {'Content-Type': 'text/plain', 'correlationId': 'abc'}).read()
+
+        entries = [json.loads(line) for line in stderr.getvalue().splitlines() if 'slow_request' in line]
+        self.assertEqual(1, len(entries))
+        self.assertEqual('abc', entries[0]['correlationId'])
+        self.assertEqual(200, entries[0]['status'])
+        self.assertGreaterEqual(entries[0]['stages_ms']['invoke'], 400)
+        self.assertGreaterEqual(entries[0]['stages_ms']['total'], 500)
+
+    def test_ready(self):
+        run_function(port=self.port, module="upper.py", handler="handle")
+
+        response = call_get(self.port, '/ready', {})
+
+        self.assertEqual(200, response.status)
+        self.assertEqual(b'true', response.read())
+
+    def test_concurrency_limit(self):
+        run_function(port=self.port, module="coroutines.py", handler="slow", MAX_CONCURRENCY='2')
+
+        statuses = []
+
+        def call():
+            try:
+                statuses.append(call_http(self.port, "hello", {}).status)
+            except HTTPError as e:
+                statuses.append(e.code)
+                self.assertEqual('1', e.headers['Retry-After'])
+
+        threads = [Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(2, statuses.count(200))
+        self.assertEqual(4, statuses.count(429))
+
+    def test_queue_wait_budget(self):
+        http_server.QUEUE_SIZE, queue_size = 1, http_server.QUEUE_SIZE
+        try:
+            run_function(port=self.port, module="blocking.py", handler="sleep", QUEUE_WAIT_MS='100',
+                         EXECUTOR='threadpool', POOL_SIZE='1')
+        finally:
+            http_server.QUEUE_SIZE = queue_size
+
+        def call():
+            try:
+                statuses.append(call_http(self.port, "hello", {}).status)
+            except HTTPError as e:
+                statuses.append(e.code)
+
+        statuses = []
+        threads = [Thread(target=call) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn(200, statuses)
+        self.assertIn(503, statuses)
+        self.assertEqual(4, statuses.count(200) + statuses.count(503))
+
+    def test_response_cache(self):
+        import cached
+        run_function(port=self.port, module="cached.py", handler="lookup")
+
+        responses = []
+        threads = [Thread(target=lambda: responses.append(call_http(self.port, "hello", {}).read()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([b'HELLO'] * 5, responses)
+        self.assertEqual(b'HELLO', call_http(self.port, "hello", {}).read())
+        self.assertEqual(["hello"], cached.calls)
+
+        self.assertEqual(b'WORLD', call_http(self.port, "world", {}).read())
+        self.assertEqual(["hello", "world"], cached.calls)
+
+    def test_spooled_payload(self):
+        run_function(port=self.port, module="uploads.py", handler="total", SPOOL_THRESHOLD='64')
+
+        items = [{"amount": n} for n in range(1000)]
+        response = call_http(self.port, json.dumps(items), {'Content-Type': 'application/json'})
+        self.assertEqual(b'499500', response.read())
+
+        lines = ('{"amount": %d}\n' % n for n in range(10))
+        response = call_chunked_http(self.port, lines, {'Content-Type': 'application/x-ndjson'})
+        self.assertEqual(b'45', response.read())
+
+        with self.assertRaises(HTTPError) as raised:
+            call_http(self.port, 'amount: 1', {'Content-Type': 'text/plain'})
+        self.assertEqual(415, raised.exception.code)
+        self.assertRegex(raised.exception.read().decode(), 'must be application/x-ndjson or a JSON array')
+
+    def test_compression(self):
+        run_function(port=self.port, module="upper.py", handler="handle", COMPRESSION_MIN_SIZE='100')
+
+        message = 'hello world ' * 100
+        response = call_http(self.port, gzip.compress(message.encode()),
+                             {'Content-Encoding': 'gzip', 'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.getheader('Content-Encoding'))
+        self.assertEqual(message.upper().encode(), gzip.decompress(response.read()))
+
+        response = call_http(self.port, 'small', {'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(b'SMALL', response.read())
+
+        response = call_http(self.port, message, {})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(message.upper().encode(), response.read())
+
+        with self.assertRaises(HTTPError) as raised:
+            call_http(self.port, message, {'Content-Encoding': 'br'})
+        self.assertEqual(415, raised.exception.code)
+
+    def test_invalid_compressed_body(self):
+        run_function(port=self.port, module="upper.py", handler="handle")
+
+        with self.assertRaises(HTTPError) as raised:
+            call_http(self.port, 'plain text', {'Content-Encoding': 'gzip'})
+        self.assertEqual(400, raised.exception.code)
+        self.assertRegex(raised.exception.read().decode(), 'invalid gzip body')
+
+        with self.assertRaises(HTTPError) as raised:
+            call_http(self.port, gzip.compress(b'hello world')[:-6], {'Content-Encoding': 'gzip'})
+        self.assertEqual(400, raised.exception.code)
+        self.assertRegex(raised.exception.read().decode(), 'truncated gzip body')
+
+    def test_invalid_compressed_stream(self):
+        run_function(port=self.port, module="windows.py", handler="discrete_window_text")
+
+        response = call_chunked_http(self.port, [b'"not gzip"\n'], {'Content-Type': framing.NDJSON,
+                                                                     'Content-Encoding': 'gzip'})
+
+        self.assertEqual(400, response.status)
+
+    def test_compressed_stream(self):
+        run_function(port=self.port, module="windows.py", handler="discrete_window_text")
+
+        body = gzip.compress(''.join('"%d"\n' % i for i in range(9)).encode())
+        response = call_chunked_http(self.port, [body], {'Content-Type': framing.NDJSON, 'Content-Encoding': 'gzip',
+                                                         'Accept-Encoding': 'gzip'})
+
+        self.assertEqual('gzip', response.getheader('Content-Encoding'))
+        self.assertEqual(b'["0", "1", "2"]\n["3", "4", "5"]\n["6", "7", "8"]\n', gzip.decompress(response.read()))
+
+    def test_bulk_ndjson(self):
+        run_function(port=self.port, module="values.py", handler="keys")
+
+        response = call_http(self.port, '{"b": 1, "a": 2}\n42\n\n["c"]\n', {'Content-Type': framing.NDJSON})
+
+        self.assertEqual(framing.NDJSON, response.getheader('Content-Type'))
+        lines = [json.loads(line) for line in response.read().splitlines()]
+        self.assertEqual({'result': ['a', 'b']}, lines[0])
+        self.assertRegex(lines[1]['error'], 'TypeError')
+        self.assertEqual({'result': ['c']}, lines[2])
+        self.assertEqual(3, len(lines))
+
+    def test_bulk_serialized_results(self):
+        run_function(port=self.port, module="values.py", handler="serialized")
+
+        single = call_http(self.port, '{"b": 1, "a": 2}', {'Content-Type': 'application/json'}).read()
+        bulk = call_http(self.port, '{"b": 1, "a": 2}\n', {'Content-Type': framing.NDJSON}).read()
+
+        # a str result is serialized JSON already, in bulk as for a single message
+        self.assertEqual(b'["a", "b"]', single)
+        self.assertEqual(b'{"result": ["a", "b"]}\n', bulk)
+
+    def test_bulk_bytes_results(self):
+        run_function(port=self.port, module="values.py", handler="encoded")
+
+        response = call_http(self.port, '[1, 2, 3]\n', {'Content-Type': framing.NDJSON})
+
+        self.assertEqual(b'{"result": 3}\n', response.read())
+
+    def test_bulk_json_array(self):
+        run_function(port=self.port, module="values.py", handler="count")
+
+        response = call_http(self.port, '[["a"], 5, {"b": 1, "c": 2}]', {'Content-Type': 'application/json'},
+                             path='/?bulk=true')
+
+        lines = [json.loads(line) for line in response.read().splitlines()]
+        self.assertEqual([{'result': 1},
+                          {'error': "Error Invoking Function: TypeError(\"object of type 'int' has no len()\")"},
+                          {'result': 2}], lines)
+
+    def test_bulk_invalid(self):
+        run_function(port=self.port, module="values.py", handler="count")
+
+        with self.assertRaises(HTTPError) as raised:
+            call_http(self.port, '{"not": "an array"}', {'Content-Type': 'application/json'}, path='/?bulk=1')
+        self.assertEqual(400, raised.exception.code)
+
+        response = call_http(self.port, '"fine"\nnot json\n"unread"\n', {'Content-Type': framing.NDJSON})
+        lines = [json.loads(line) for line in response.read().splitlines()]
+        self.assertEqual({'result': 4}, lines[0])
+        self.assertRegex(lines[1]['error'], '^Invalid bulk request')
+        self.assertEqual(2, len(lines))
+
+    def test_bulk_batch(self):
+        run_function(port=self.port, module="batch.py", handler="lengths", BATCH_SIZE='2')
+
+        response = call_http(self.port, '"a"\n"b"\n"c"\n', {'Content-Type': framing.NDJSON})
+
+        self.assertEqual(b'{"result": 2}\n{"result": 2}\n{"result": 1}\n', response.read())
+
     def test_json_processing(self):
         run_function(port=self.port, module="concat.py", handler="concat")
 
@@ -95,6 +580,36 @@ class HttpFunctionTest(unittest.TestCase):
 
         self.assertEqual(b'{"result": "foobarhelloworld"}', response.read())
 
+    def test_json_list_result(self):
+        run_function(port=self.port, module="values.py", handler="keys")
+
+        response = call_http(port=self.port, message='{"foo":"bar","hello":"world"}',
+                             headers={'Content-Type': 'application/json'})
+
+        self.assertEqual(b'["foo", "hello"]', response.read())
+
+    def test_msgpack_negotiation(self):
+        run_function(port=self.port, module="values.py", handler="keys")
+
+        response = call_http(port=self.port, message=codec.MSGPACK.encode({'foo': 'bar'}, 'application/msgpack'),
+                             headers={'Content-Type': 'application/msgpack', 'Accept': 'application/json'})
+        self.assertEqual('application/json', response.getheader('Content-Type'))
+        self.assertEqual(b'["foo"]', response.read())
+
+        response = call_http(port=self.port, message='{"foo":"bar"}',
+                             headers={'Content-Type': 'application/json',
+                                      'Accept': 'application/json, application/msgpack'})
+        self.assertEqual('application/msgpack', response.getheader('Content-Type'))
+        self.assertEqual(['foo'], codec.MSGPACK.decode(response.read(), 'application/msgpack'))
+
+    def test_text_negotiation(self):
+        run_function(port=self.port, module="values.py", handler="echo")
+
+        response = call_http(port=self.port, message='{"foo": ["bar"]}',
+                             headers={'Content-Type': 'application/json', 'Accept': 'text/plain'})
+        self.assertEqual('text/plain', response.getheader('Content-Type'))
+        self.assertEqual({'foo': ['bar']}, json.loads(response.read()))
+
     def test_error_handling(self):
         run_function(port=self.port, module="error.py", handler="nogood")
 
@@ -108,21 +623,101 @@ class HttpFunctionTest(unittest.TestCase):
         self.assertRegex(response, "Error thrown by Function")
 
 
-def call_http(port, message, headers):
-    url = 'http://localhost:' + str(port)
+class RoutesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.port = testutils.find_free_port()
+
+    def tearDown(self):
+        function_invoker.stop()
+
+    def test_routes(self):
+        functions = '%s/tests/functions' % os.getcwd()
+        env = {
+            'FUNCTION_ROUTES': '/upper=file://%s/mixed.py?handler=upper, /pairs=file://%s/mixed.py?handler=pairs '
+                               '/echo/=file://%s/upper.py?handler=handle' % (functions, functions, functions),
+            'PORT': self.port,
+        }
+        routes = function_invoker.install_routes(env)
+        Thread(target=function_invoker.run, args=(routes, env)).start()
+        time.sleep(1)
+
+        self.assertEqual(b'HELLO', call_http(self.port, 'hello', {}, '/upper').read())
+        self.assertEqual(b'HI', call_http(self.port, 'hi', {}, '/echo/nested').read())
+        response = call_chunked_http(self.port, ('"%s"\n' % word for word in 'abcd'), {'Content-Type': framing.NDJSON},
+                                     '/pairs')
+        self.assertEqual(b'a b\nc d\n', response.read())
+
+        with self.assertRaises(HTTPError) as context:
+            call_http(self.port, 'hello', {}, '/other')
+        self.assertEqual(404, context.exception.code)
+
+        body = call_get(self.port, '/metrics', {}).read().decode()
+        self.assertRegex(body, 'invoker_invocation_duration_seconds_count{route="/upper"} 1')
+        self.assertRegex(body, 'invoker_queue_depth{route="/pairs"} 0')
+        self.assertRegex(body, 'invoker_queue_capacity{route="/echo"} 50')
+
+
+class WorkersTest(unittest.TestCase):
+    """
+    Runs function_invoker in a child process with pre-forked workers.
+    Assumes os.getcwd() is the project base directory
+    """
+
+    def setUp(self):
+        self.port = testutils.find_free_port()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), '%s/tests/functions' % os.getcwd()]),
+                   PORT=str(self.port), WORKERS='2',
+                   **function_env(self.port, 'worker.py', 'pid'))
+        self.process = subprocess.Popen([sys.executable, '-m', 'invoker.function_invoker'], env=env)
+        time.sleep(2)
+
+    def tearDown(self):
+        self.process.terminate()
+        self.process.wait(timeout=10)
 
-    req = urllib.request.Request(url, message.encode(), method="POST", headers=headers)
+    def test_respawn_worker(self):
+        pid = int(call_http(self.port, 'hello', {}).read())
+        self.assertNotEqual(self.process.pid, pid)
+
+        os.kill(pid, signal.SIGKILL)
+        time.sleep(1.5)
+
+        for _ in range(10):
+            self.assertNotEqual(pid, int(call_http(self.port, 'hello', {}).read()))
+        self.assertIsNone(self.process.poll())
+
+
+def call_http(port, message, headers, path='/'):
+    url = 'http://localhost:' + str(port) + path
+
+    data = message.encode() if isinstance(message, str) else bytes(message)
+    req = urllib.request.Request(url, data, method="POST", headers=headers)
     return urllib.request.urlopen(req)
 
 
+def call_chunked_http(port, chunks, headers, path='/'):
+    connection = http.client.HTTPConnection('localhost', port)
+    connection.request('POST', path, body=(chunk.encode() if isinstance(chunk, str) else chunk for chunk in chunks),
+                       headers=headers, encode_chunked=True)
+    return connection.getresponse()
+
+
+def call_get(port, path, headers):
+    connection = http.client.HTTPConnection('localhost', port)
+    connection.request('GET', path, headers=headers)
+    return connection.getresponse()
+
+
 def call_multiple_http_messages(port, messages, headers={}):
     return [call_http(port, message,headers) for message in messages]
 
 
-def run_function(port, module, handler):
-    fi = function_invoker.install_function(function_env(port, module, handler))
+def run_function(port, module, handler, **env):
+    env.update(function_env(port, module, handler))
+    fi = function_invoker.install_function(env)
 
-    thread = Thread(target=function_invoker.run, args=(fi, {"PORT": port}))
+    thread = Thread(target=function_invoker.run, args=(fi, dict(env, PORT=port)))
     thread.start()
     time.sleep(1)
     return thread
@@ -0,0 +1,77 @@
+import io
+import unittest
+
+from invoker import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter(self):
+        registry = []
+        counter = metrics.Counter('requests_total', 'Requests', ('status',), registry=registry)
+        counter.labels('200').inc()
+        counter.labels('200').inc(2)
+        counter.labels('500').inc()
+
+        self.assertEqual(b'# HELP requests_total Requests\n'
+                         b'# TYPE requests_total counter\n'
+                         b'requests_total{status="200"} 3\n'
+                         b'requests_total{status="500"} 1\n', metrics.render(registry))
+
+    def test_empty_label_is_omitted(self):
+        registry = []
+        counter = metrics.Counter('rejected_total', 'Rejected', ('route', 'reason'), registry=registry)
+        counter.labels('', 'queue_wait').inc()
+        counter.labels('/upper', 'queue_wait').inc()
+
+        self.assertIn(b'\nrejected_total{reason="queue_wait"} 1\n'
+                      b'rejected_total{route="/upper",reason="queue_wait"} 1\n', metrics.render(registry))
+
+    def test_gauge_function(self):
+        registry = []
+        gauge = metrics.Gauge('depth', 'Depth', registry=registry)
+        gauge.set_function(lambda: 7)
+
+        self.assertIn(b'\ndepth 7\n', metrics.render(registry))
+
+    def test_histogram(self):
+        registry = []
+        histogram = metrics.Histogram('latency_seconds', 'Latency', registry=registry, buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+
+        self.assertEqual(b'# HELP latency_seconds Latency\n'
+                         b'# TYPE latency_seconds histogram\n'
+                         b'latency_seconds_bucket{le="0.1"} 2\n'
+                         b'latency_seconds_bucket{le="1"} 3\n'
+                         b'latency_seconds_bucket{le="+Inf"} 4\n'
+                         b'latency_seconds_sum 2.65\n'
+                         b'latency_seconds_count 4\n', metrics.render(registry))
+
+    def test_label_escaping(self):
+        registry = []
+        counter = metrics.Counter('total', 'Total', ('name',), registry=registry)
+        counter.labels('a "quoted"\nname').inc()
+
+        self.assertIn(b'total{name="a \\"quoted\\"\\nname"} 1', metrics.render(registry))
+
+    def test_content_type_label(self):
+        self.assertEqual('application/json', metrics.content_type_label('application/json; charset=UTF-8'))
+        self.assertEqual('application/x-ndjson', metrics.content_type_label('application/x-ndjson'))
+        self.assertEqual('text/plain', metrics.content_type_label('text/plain'))
+        self.assertEqual('', metrics.content_type_label(''))
+        self.assertEqual('other', metrics.content_type_label('application/x-%d' % id(self)))
+        self.assertEqual('other', metrics.content_type_label('text/*'))
+
+    def test_instrument_content_type(self):
+        app = metrics.instrument(lambda environ, start_response: start_response('200 OK', []) or [b'ok'])
+        for contenttype in ('text/x-one', 'text/x-two'):
+            app({'CONTENT_TYPE': contenttype, 'wsgi.input': io.BytesIO()}, lambda status, headers, exc_info=None: None)
+
+        body = metrics.render().decode()
+        self.assertIn('invoker_requests_total{content_type="other",status="200"}', body)
+        self.assertNotIn('text/x-one', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
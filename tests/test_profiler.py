@@ -0,0 +1,76 @@
+import threading
+import unittest
+from collections import Counter
+from unittest import mock
+
+import gevent
+
+from invoker import profiler
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_sample(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=spin, args=(stop,), name='spinner')
+        thread.start()
+        try:
+            stacks = profiler.sample(0.2, 0.005)
+        finally:
+            stop.set()
+            thread.join()
+
+        spinning = [frames for frames in stacks if frames[0] == 'spinner']
+        self.assertTrue(spinning)
+        self.assertTrue(all('tests.test_profiler.spin' in frames for frames in spinning))
+        self.assertEqual('threading.Thread._bootstrap', spinning[0][1])
+
+    def test_collapsed(self):
+        stacks = {('main', 'a.f', 'a.g'): 3, ('main', 'a.f'): 1, ('main', 'odd;name'): 2}
+
+        self.assertEqual(b'main;a.f 1\nmain;a.f;a.g 3\nmain;odd:name 2\n', profiler.collapsed(stacks))
+
+    def test_profile_blocks_only_the_greenlet(self):
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(1)
+                gevent.sleep(0.01)
+
+        ticker = gevent.spawn(tick)
+        try:
+            samples = profiler.profile(0.2)
+        finally:
+            ticker.kill()
+
+        self.assertGreater(len(ticks), 5)
+        self.assertIn(b'MainThread;', samples)
+
+    def test_one_profile_at_a_time(self):
+        first = gevent.spawn(profiler.profile, 0.2)
+        gevent.sleep(0.05)
+
+        with self.assertRaises(profiler.Busy):
+            profiler.profile(0.1)
+        first.join()
+
+    def test_invalid_arguments(self):
+        for seconds, interval in ((0, 0.01), (-1, 0.01), (float('nan'), 0.01), (1, -0.001)):
+            with self.assertRaises(ValueError):
+                profiler.profile(seconds, interval)
+
+    def test_interval_is_bounded(self):
+        with mock.patch.object(profiler, 'sample', return_value=Counter()) as sample:
+            profiler.profile(120, 0)
+
+        sample.assert_called_once_with(profiler.MAX_SECONDS, profiler.MIN_INTERVAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+from tests.utils import testutils
+
+sys.path.append('%s/tests/functions' % os.getcwd())
+
+from invoker import function_invoker
+from invoker import socket_server
+from invoker.socket_server import INVOKE, RESULT, ERROR, DATA, END
+
+
+class FramingTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        frames = [(INVOKE, 'a', 'application/json', b'"hello"'), (END, '☃', 'text/plain', b''),
+                  (DATA, '', 'application/octet-stream', bytes(range(256)))]
+        data = b''.join(socket_server.pack(*frame) for frame in frames)
+
+        self.assertEqual(frames, list(socket_server.read_frames(io.BytesIO(data))))
+
+    def test_default_content_type(self):
+        data = socket_server.pack(INVOKE, '1', '', b'{}')
+
+        self.assertEqual('application/json', next(socket_server.read_frames(io.BytesIO(data)))[2])
+
+    def test_truncated(self):
+        data = socket_server.pack(INVOKE, '1', 'text/plain', b'hello')
+
+        with self.assertRaises(ValueError):
+            list(socket_server.read_frames(io.BytesIO(data[:-1])))
+        with self.assertRaises(ValueError):
+            list(socket_server.read_frames(io.BytesIO(data[:3])))
+
+    def test_invalid_lengths(self):
+        following = socket_server.pack(INVOKE, '2', 'text/plain', b'next')
+
+        # a length shorter than the fixed fields
+        data = struct.pack('>IBHH', 2, INVOKE, 0, 0) + following
+        with self.assertRaises(ValueError):
+            list(socket_server.read_frames(io.BytesIO(data)))
+
+        # a correlation id and content type longer than the frame
+        data = struct.pack('>IBHH', 5 + 4, INVOKE, 3, 10) + b'abcd' + following
+        with self.assertRaises(ValueError):
+            list(socket_server.read_frames(io.BytesIO(data)))
+
+
+class SocketServerTest(unittest.TestCase):
+    """
+    Spawns function_invoker in a separate thread, serving http and a Unix domain socket.
+    Assumes os.getcwd() is the project base directory
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'invoker.sock')
+
+    def tearDown(self):
+        function_invoker.stop()
+
+    def test_invoke(self):
+        run_function(self.path, 'lookups.py', 'lookup')
+
+        with connect(self.path) as client:
+            # the second invocation completes first, results are matched by correlation id
+            client.sendall(socket_server.pack(INVOKE, 'slow', 'application/json', b'"0.2"') +
+                           socket_server.pack(INVOKE, 'fast', 'application/json', b'"0.01"'))
+            frames = socket_server.read_frames(client.makefile('rb'))
+
+            self.assertEqual((RESULT, 'fast', 'application/json', b'0.01'), next(frames))
+            self.assertEqual((RESULT, 'slow', 'application/json', b'0.2'), next(frames))
+
+    def test_invoke_error(self):
+        run_function(self.path, 'lookups.py', 'failing')
+
+        with connect(self.path) as client:
+            client.sendall(socket_server.pack(INVOKE, '1', 'text/plain', b'bad') +
+                           socket_server.pack(INVOKE, '2', 'application/json', b'not json') +
+                           socket_server.pack(INVOKE, '3', 'text/plain', b'good'))
+            frames = {frame[1]: frame for frame in islice_frames(client, 3)}
+
+        self.assertEqual(ERROR, frames['1'][0])
+        self.assertRegex(frames['1'][3].decode(), "ValueError\\('bad'\\)")
+        self.assertEqual(ERROR, frames['2'][0])
+        self.assertEqual((RESULT, '3', 'text/plain', b'good'), frames['3'])
+
+    def test_stream_sessions(self):
+        run_function(self.path, 'streamer.py', 'bidirectional')
+
+        with connect(self.path) as client:
+            client.sendall(socket_server.pack(DATA, 'a', 'text/plain', b'one') +
+                           socket_server.pack(DATA, 'b', 'text/plain', b'two') +
+                           socket_server.pack(DATA, 'a', 'text/plain', b'three') +
+                           socket_server.pack(END, 'a', 'text/plain', b'') +
+                           socket_server.pack(END, 'b', 'text/plain', b''))
+            frames = islice_frames(client, 5)
+
+        self.assertEqual([(DATA, b'ONE'), (DATA, b'THREE'), (END, b'')],
+                         [(kind, payload) for kind, id, _, payload in frames if id == 'a'])
+        self.assertEqual([(DATA, b'TWO'), (END, b'')],
+                         [(kind, payload) for kind, id, _, payload in frames if id == 'b'])
+
+    def test_ended_session(self):
+        run_function(self.path, 'streamer.py', 'failing')
+
+        with connect(self.path) as client:
+            # the frames after the failing one belong to the failed session, they do not open new ones
+            client.sendall(socket_server.pack(DATA, 'a', 'text/plain', b'bad') +
+                           b''.join(socket_server.pack(DATA, 'a', 'text/plain', b'more') for _ in range(199)) +
+                           socket_server.pack(END, 'a', 'text/plain', b'') +
+                           socket_server.pack(DATA, 'b', 'text/plain', b'good') +
+                           socket_server.pack(END, 'b', 'text/plain', b'') +
+                           socket_server.pack(DATA, 'a', 'text/plain', b'again') +
+                           socket_server.pack(END, 'a', 'text/plain', b''))
+            frames = islice_frames(client, 5)
+
+        # the id opens a new session once the client has ended the failed one
+        self.assertEqual([ERROR, DATA, END], [kind for kind, id, _, _ in frames if id == 'a'])
+        self.assertEqual(b'AGAIN', [payload for kind, id, _, payload in frames if id == 'a'][1])
+        self.assertEqual([(DATA, b'GOOD'), (END, b'')],
+                         [(kind, payload) for kind, id, _, payload in frames if id == 'b'])
+
+    def test_http_still_served(self):
+        port = run_function(self.path, 'upper.py', 'handle')
+
+        with connect(self.path) as client:
+            client.sendall(socket_server.pack(INVOKE, '1', 'application/json', json.dumps('hello').encode()))
+            self.assertEqual((RESULT, '1', 'application/json', b'HELLO'), islice_frames(client, 1)[0])
+
+        connection = socket.create_connection(('localhost', port))
+        connection.sendall(b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Type: text/plain\r\n'
+                           b'Content-Length: 5\r\nConnection: close\r\n\r\nworld')
+        self.assertTrue(connection.makefile('rb').read().endswith(b'WORLD'))
+        connection.close()
+
+
+def run_function(path, module, handler):
+    port = testutils.find_free_port()
+    env = {
+        'FUNCTION_URI': 'file://%s/tests/functions/%s?handler=%s' % (os.getcwd(), module, handler),
+        'PORT': port,
+        'SOCKET_PATH': path,
+    }
+    fi = function_invoker.install_function(env)
+    Thread(target=function_invoker.run, args=(fi, env)).start()
+    time.sleep(1)
+    return port
+
+
+def connect(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(path)
+    return client
+
+
+def islice_frames(client, count):
+    frames = socket_server.read_frames(client.makefile('rb'))
+    return [next(frames) for _ in range(count)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import json
+import mmap
+import unittest
+
+from invoker import spool
+from invoker.spool import Spooled
+
+
+class SpoolTest(unittest.TestCase):
+
+    def test_file(self):
+        spooled = Spooled(io.BytesIO(b'hello'), 'text/plain', 'file', threshold=10)
+
+        self.assertFalse(spooled.on_disk)
+        self.assertEqual(b'hello', spooled.argument.read())
+        spooled.close()
+
+    def test_file_on_disk(self):
+        spooled = Spooled(io.BytesIO(b'x' * 100), 'application/octet-stream', 'file', threshold=10)
+
+        self.assertTrue(spooled.on_disk)
+        spooled.argument.seek(90)
+        self.assertEqual(b'x' * 10, spooled.argument.read())
+        spooled.close()
+
+    def test_mmap(self):
+        spooled = Spooled(io.BytesIO(b'0123456789' * 10), 'application/octet-stream', 'mmap', threshold=10)
+
+        self.assertIsInstance(spooled.argument, mmap.mmap)
+        self.assertEqual(b'5678', spooled.argument[15:19])
+        view = memoryview(spooled.argument)[:3]
+        spooled.close()
+        self.assertEqual(b'012', bytes(view))
+
+    def test_mmap_in_memory(self):
+        spooled = Spooled(io.BytesIO(b'small'), 'application/octet-stream', 'mmap', threshold=10)
+
+        self.assertEqual(b'mal', bytes(spooled.argument[1:4]))
+        spooled.close()
+
+    def test_ndjson_items(self):
+        spooled = Spooled(io.BytesIO(b'{"a": 1}\n\n[2]\n"three"\n'), 'application/x-ndjson', 'items')
+
+        self.assertEqual([{'a': 1}, [2], 'three'], list(spooled.argument))
+        spooled.close()
+
+    def test_json_array_items(self):
+        items = [1, 23456, -7.5e3, 'caf\xe9 ☃', {'nested': [1, {'deep': None}]}, [], True, False, None, '']
+        data = json.dumps(items, ensure_ascii=False).encode('utf-8')
+
+        for chunk_size in (1, 2, 3, 7, 1024):
+            self.assertEqual(items, list(spool.iter_json_array(io.BytesIO(data), chunk_size)), chunk_size)
+
+    def test_json_array_whitespace(self):
+        self.assertEqual([1, 2], list(spool.iter_json_array(io.BytesIO(b' \n[ 1 ,\n 2 ] '), 2)))
+        self.assertEqual([], list(spool.iter_json_array(io.BytesIO(b'[ ]'), 1)))
+
+    def test_json_array_errors(self):
+        for data in (b'{"a": 1}', b'[1, 2', b'[1 2]', b'[1, }', b''):
+            with self.assertRaises(ValueError, msg=data):
+                list(spool.iter_json_array(io.BytesIO(data), 2))
+
+    def test_items_needs_json(self):
+        with self.assertRaises(spool.UnsupportedPayload):
+            Spooled(io.BytesIO(b'text'), 'text/plain', 'items')
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Spooled(io.BytesIO(b''), 'text/plain', 'lines')
+
+
+if __name__ == '__main__':
+    unittest.main()
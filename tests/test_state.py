@@ -0,0 +1,118 @@
+import sqlite3
+import tempfile
+import unittest
+
+import gevent
+
+from invoker import state
+from invoker.state import KeyedState
+
+
+class KeyedStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.directory.cleanup()
+
+    def open(self, **kwargs):
+        store = KeyedState('test', directory=self.directory.name, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def persisted(self, store):
+        with sqlite3.connect(store.path) as db:
+            return {key for key, in db.execute('SELECT key FROM state')}
+
+    def test_get_put_delete(self):
+        store = self.open()
+
+        self.assertIsNone(store.get('a'))
+        store['a'] = {'count': 1}
+        self.assertEqual({'count': 1}, store['a'])
+        self.assertIn('a', store)
+        self.assertEqual(3, store.update('b', lambda value: value + 1, 2))
+
+        del store['a']
+        self.assertNotIn('a', store)
+        with self.assertRaises(KeyError):
+            store['a']
+
+    def test_spills_beyond_max_entries(self):
+        store = self.open(max_entries=2)
+
+        for i in range(10):
+            store.put('key-%d' % i, i)
+
+        self.assertEqual(2, len(store.entries))
+        self.assertEqual(list(range(10)), [store.get('key-%d' % i) for i in range(10)])
+        self.assertEqual(2, len(store.entries))
+
+    def test_restore_after_restart(self):
+        store = self.open(max_entries=2)
+        for i in range(5):
+            store.put(i, 'value-%d' % i)
+        store.delete(4)
+        store.close()
+
+        restored = self.open()
+        self.assertEqual(['value-%d' % i for i in range(4)] + [None], [restored.get(i) for i in range(5)])
+
+    def test_checkpoint(self):
+        store = self.open(checkpoint_interval=None)
+        store.put('a', 1)
+        self.assertEqual(set(), self.persisted(store))
+
+        store.checkpoint()
+        self.assertEqual({'a'}, self.persisted(store))
+
+        store.delete('a')
+        store.checkpoint()
+        self.assertEqual(set(), self.persisted(store))
+
+    def test_periodic_checkpoint(self):
+        store = self.open(checkpoint_interval=0.05)
+        store.put('a', 1)
+
+        gevent.sleep(0.2)
+        self.assertEqual({'a'}, self.persisted(store))
+
+    def test_put_from_threadpool(self):
+        store = self.open(checkpoint_interval=0.2)
+
+        pool = gevent.get_hub().threadpool
+        pool.map(lambda i: store.update('count', lambda count: count + 1, 0), range(100))
+
+        gevent.sleep(0.5)
+        self.assertEqual({'count'}, self.persisted(store))
+        self.assertEqual(100, store['count'])
+
+    def test_ttl(self):
+        store = self.open(ttl=0.05, max_entries=1)
+        store.put('a', 1)
+        store.put('b', 2)
+        store.checkpoint()
+
+        gevent.sleep(0.1)
+        self.assertIsNone(store.get('a'))
+        self.assertNotIn('b', store)
+        store.checkpoint()
+        self.assertEqual(set(), self.persisted(store))
+
+    def test_close_all(self):
+        store = KeyedState('other', directory=self.directory.name)
+        store.put('a', 1)
+
+        state.close_all()
+
+        self.assertNotIn(store, state.STORES)
+        self.assertEqual({'a'}, self.persisted(store))
+        self.stores = []
+
+
+if __name__ == '__main__':
+    unittest.main()
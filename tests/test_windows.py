@@ -0,0 +1,90 @@
+import unittest
+
+import gevent
+from gevent.queue import Queue
+
+from invoker import windows
+
+
+def timed_stream(items):
+    """a stream yielding each value after waiting for the given delay, from (delay, value) pairs"""
+    for delay, value in items:
+        gevent.sleep(delay)
+        yield value
+
+
+class WindowsTest(unittest.TestCase):
+
+    def test_tumbling(self):
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], list(windows.tumbling(iter(range(7)), 3)))
+
+    def test_tumbling_aggregate(self):
+        self.assertEqual([3, 12, 6], list(windows.tumbling(iter(range(7)), 3, aggregate=windows.Sum)))
+
+    def test_sliding(self):
+        self.assertEqual([[0, 1, 2], [1, 2, 3], [2, 3, 4]], [list(w) for w in windows.sliding(iter(range(5)), 3)])
+
+    def test_sliding_step(self):
+        self.assertEqual([[0, 1, 2], [2, 3, 4], [4, 5, 6]],
+                         [list(w) for w in windows.sliding(iter(range(7)), 3, step=2)])
+        self.assertEqual(list(windows.tumbling(iter(range(6)), 3)),
+                         [list(w) for w in windows.sliding(iter(range(6)), 3, step=3)])
+
+    def test_sliding_aggregates_match_recomputing(self):
+        items = [5, 3, 8, 1, 9, 2, 7, 7, 0, 4, 6]
+        aggregate = lambda: windows.Aggregations(count=windows.Count(), sum=windows.Sum(), mean=windows.Mean(),
+                                                 min=windows.Min(), max=windows.Max())
+
+        results = list(windows.sliding(iter(items), 4, aggregate=aggregate))
+
+        expected = [items[i:i + 4] for i in range(len(items) - 3)]
+        self.assertEqual([{'count': 4, 'sum': sum(w), 'mean': sum(w) / 4, 'min': min(w), 'max': max(w)}
+                          for w in expected], results)
+
+    def test_timed_flushes_when_idle(self):
+        stream = timed_stream([(0, 'a'), (0, 'b'), (0.3, 'c')])
+
+        results = windows.timed(stream, 0.1)
+
+        with gevent.Timeout(0.2):
+            self.assertEqual(['a', 'b'], next(results))
+        self.assertEqual([['c']], list(results))
+
+    def test_timed_size(self):
+        self.assertEqual([[0, 1], [2, 3], [4]], list(windows.timed(iter(range(5)), 10, size=2)))
+
+    def test_session(self):
+        stream = timed_stream([(0, 1), (0.05, 2), (0.05, 3), (0.3, 4), (0.05, 5)])
+
+        self.assertEqual([6, 9], list(windows.session(stream, 0.15, aggregate=windows.Sum)))
+
+    def test_session_flushes_while_stream_waits(self):
+        queue = Queue()
+        results = windows.session(queue, 0.1)
+        queue.put('a')
+
+        with gevent.Timeout(1):
+            self.assertEqual(['a'], next(results))
+        results.close()
+
+    def test_errors_reach_the_function(self):
+        def failing():
+            yield 1
+            raise ValueError('bad input')
+
+        with self.assertRaises(ValueError):
+            list(windows.timed(failing(), 1))
+
+    def test_min_max_with_duplicates(self):
+        minimum, maximum = windows.Min(), windows.Max()
+        for item in (2, 1, 1, 3):
+            minimum.add(item)
+            maximum.add(item)
+        for expected_min, expected_max in ((1, 3), (1, 3), (3, 3), (None, None)):
+            minimum.remove(None)
+            maximum.remove(None)
+            self.assertEqual((expected_min, expected_max), (minimum.value, maximum.value))
+
+
+if __name__ == '__main__':
+    unittest.main()